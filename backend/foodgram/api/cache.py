@@ -0,0 +1,366 @@
+"""Двухуровневый кеш: LRU в памяти процесса поверх общего кеша.
+
+Первый уровень - ограниченный MAX_ENTRIES словарь в памяти процесса,
+общий для потоков. Второй - кеш из LOCATION (таблица DatabaseCache),
+общий для воркеров. Записанные и удаленные ключи публикуются строками
+CacheInvalidation: в запросе они копятся (CacheBatchMiddleware) и
+записываются одним INSERT после ответа, вне запроса - сразу. Перед
+первым обращением в запросе кеш читает строки с id больше последнего
+прочитанного и удаляет эти ключи из памяти. Старые строки удаляет
+prune_invalidations из run_workers.
+Запись живёт в памяти не дольше CACHE_L1_TTL секунд, это ограничивает
+устаревание, если изменение пропущено.
+
+Значения первого уровня возвращаются без копирования, изменять их
+нельзя.
+
+get_or_compute пересчитывает дорогие значения одним воркером: первый
+промахнувшийся берет аренду в общем кеше, остальные отдают устаревшее
+значение или недолго ждут нового. Незадолго до истечения значение
+с растущей вероятностью пересчитывается заранее (XFetch), поэтому
+ключи не истекают у всех воркеров одновременно. Первый пересчет после
+развертывания выполняет команда warm_cache до приема запросов.
+"""
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.signals import request_started
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from api.const import (
+    CACHE_EARLY_REFRESH_BETA,
+    CACHE_INVALIDATION_RETENTION,
+    CACHE_L1_TTL,
+    CACHE_LEASE_POLL,
+    CACHE_LEASE_POLL_MAX,
+    CACHE_LEASE_TTL,
+    CACHE_LEASE_WAIT,
+    CACHE_STALE_TTL,
+    CACHE_SYNC_INTERVAL,
+)
+from api.deadlines import suspended
+from api.metrics import CACHE_REQUESTS
+from recipes.models import CacheInvalidation
+
+MISSING = object()
+# Ключ изменения, по которому очищается весь кеш в памяти.
+ALL_KEYS = '*'
+# Версия списка рецептов меняется при сохранении и удалении рецепта.
+RECIPE_LIST_VERSION = 'recipe_list_version'
+# Полная ссылка по короткой, удаляется при изменении ShortLinkRecipe.
+SHORT_LINK_KEY = 'shortlink:{}'
+
+# Измененные в запросе ключи по кешам, пока действует batched().
+_batch = threading.local()
+
+
+class LocalTier:
+    """Первый уровень кеша, один на процесс для каждого общего кеша."""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.last_id = None
+        self.checked = False
+        self.checked_at = 0.0
+        self.own_ids = set()
+        request_started.connect(self.mark_unchecked, weak=False)
+
+    def mark_unchecked(self, **kwargs):
+        self.checked = False
+
+    def sync(self):
+        now = time.monotonic()
+        if self.checked and now - self.checked_at < CACHE_SYNC_INTERVAL:
+            return
+        if self.last_id is None or (
+            now - self.checked_at > CACHE_INVALIDATION_RETENTION
+        ):
+            self.clear()
+            self.last_id = CacheInvalidation.objects.aggregate(
+                last_id=Max('id')
+            )['last_id'] or 0
+        else:
+            changes = list(
+                CacheInvalidation.objects.filter(
+                    id__gt=self.last_id
+                ).order_by('id').values_list('id', 'key')
+            )
+            with self.lock:
+                for change_id, key in changes:
+                    if change_id in self.own_ids:
+                        self.own_ids.discard(change_id)
+                    elif key == ALL_KEYS:
+                        self.entries.clear()
+                    elif self.entries.pop(key, None) is not None:
+                        CACHE_REQUESTS.labels('l1', 'invalidation').inc()
+            if changes:
+                self.last_id = changes[-1][0]
+        self.checked = True
+        self.checked_at = now
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires <= time.time():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires, max_entries):
+        """expires - время истечения во втором уровне, None - бессрочно."""
+        limit = time.time() + CACHE_L1_TTL
+        expires = limit if expires is None else min(expires, limit)
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+                CACHE_REQUESTS.labels('l1', 'eviction').inc()
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def changed(self, key):
+        """Сообщает другим воркерам об изменении ключа."""
+        pending = getattr(_batch, 'pending', None)
+        if pending is None:
+            self.publish({key})
+        else:
+            pending.setdefault(self, set()).add(key)
+
+    def publish(self, keys):
+        if ALL_KEYS in keys:
+            keys = {ALL_KEYS}
+        changes = CacheInvalidation.objects.bulk_create(
+            CacheInvalidation(key=key) for key in sorted(keys)
+        )
+        # Без RETURNING (SQLite) свои строки просто сбросят свои ключи.
+        self.own_ids.update(
+            change.id for change in changes if change.id is not None
+        )
+
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.shared_alias = location
+        # Django создаёт экземпляр кеша на каждый поток, первый уровень
+        # общий для них.
+        with _tiers_lock:
+            if location not in _tiers:
+                _tiers[location] = LocalTier()
+            self.local = _tiers[location]
+
+    @cached_property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def local_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        local_key = self.local_key(key, version)
+        self.local.sync()
+        value = self.local.get(local_key)
+        if value is not MISSING:
+            CACHE_REQUESTS.labels('l1', 'hit').inc()
+            return value
+        CACHE_REQUESTS.labels('l1', 'miss').inc()
+        value = self.shared.get(key, MISSING, version=version)
+        if value is MISSING:
+            CACHE_REQUESTS.labels('l2', 'miss').inc()
+            return default
+        CACHE_REQUESTS.labels('l2', 'hit').inc()
+        self.local.set(local_key, value, None, self._max_entries)
+        return value
+
+    def remember(self, key, value, timeout, version):
+        local_key = self.local_key(key, version)
+        self.local.sync()
+        self.local.changed(local_key)
+        expires = self.shared.get_backend_timeout(timeout)
+        if expires is not None and expires <= time.time():
+            self.local.delete(local_key)
+        else:
+            self.local.set(local_key, value, expires, self._max_entries)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self.remember(key, value, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not self.shared.add(key, value, timeout, version=version):
+            return False
+        self.remember(key, value, timeout, version)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        local_key = self.local_key(key, version)
+        deleted = self.shared.delete(key, version=version)
+        self.local.sync()
+        self.local.delete(local_key)
+        self.local.changed(local_key)
+        return deleted
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """Значение ключа; при промахе вычисляет default и сохраняет его.
+
+        В отличие от BaseCache.get_or_set записывает значение через set,
+        без повторного чтения после add.
+        """
+        value = self.get(key, MISSING, version=version)
+        if value is MISSING:
+            value = default() if callable(default) else default
+            if value is not None:
+                self.set(key, value, timeout, version=version)
+        return value
+
+    def get_or_compute(
+        self, key, compute, timeout, version=None, generation=None
+    ):
+        """Значение ключа, которое пересчитывает только один воркер.
+
+        Хранится (значение, время истечения, время пересчета, поколение);
+        в общем кеше запись живет еще CACHE_STALE_TTL секунд после
+        истечения, чтобы ее можно было отдать во время пересчета.
+        Значение другого поколения (например, версии данных) считается
+        истекшим, но так же отдается, пока идет пересчет. None, как и
+        в get_or_set, не сохраняется.
+        """
+        envelope = self.get(key, version=version)
+        if envelope is not None:
+            # Записи прежнего формата - без поколения.
+            value, expires, delta, *stored = envelope
+            # XFetch: чем дольше пересчет и ближе истечение, тем вероятнее
+            # досрочный пересчет.
+            if stored == [generation] and time.time() - (
+                delta * CACHE_EARLY_REFRESH_BETA * math.log(
+                    1 - random.random()
+                )
+            ) < expires:
+                CACHE_REQUESTS.labels('single_flight', 'fresh').inc()
+                return value
+        lease = 'lease:' + self.local_key(key, version)
+        if self.shared.add(lease, True, CACHE_LEASE_TTL):
+            CACHE_REQUESTS.labels('single_flight', 'compute').inc()
+            try:
+                start = time.monotonic()
+                value = compute()
+                delta = time.monotonic() - start
+                if value is not None:
+                    self.set(
+                        key,
+                        (value, time.time() + timeout, delta, generation),
+                        timeout + CACHE_STALE_TTL,
+                        version=version,
+                    )
+            finally:
+                # Аренду освобождаем и после истекшего срока запроса.
+                with suspended():
+                    self.shared.delete(lease)
+            return value
+        if envelope is not None:
+            CACHE_REQUESTS.labels('single_flight', 'stale').inc()
+            return envelope[0]
+        # Отдать нечего: недолго ждем держателя аренды, опрашивая общий
+        # кеш все реже, чтобы ожидающие не нагружали базу.
+        deadline = time.monotonic() + CACHE_LEASE_WAIT
+        delay = CACHE_LEASE_POLL
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, CACHE_LEASE_POLL_MAX)
+            envelope = self.shared.get(key, version=version)
+            if envelope is not None and envelope[3:] == (generation,):
+                CACHE_REQUESTS.labels('single_flight', 'waited').inc()
+                self.local.set(
+                    self.local_key(key, version),
+                    envelope,
+                    None,
+                    self._max_entries,
+                )
+                return envelope[0]
+        # Держатель аренды не успел: считаем сами, но не записываем.
+        CACHE_REQUESTS.labels('single_flight', 'timeout').inc()
+        return compute()
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+        self.local.changed(ALL_KEYS)
+
+
+@contextmanager
+def batched():
+    """Публикует изменения ключей внутри блока одним INSERT на кеш."""
+    if getattr(_batch, 'pending', None) is not None:
+        yield
+        return
+    _batch.pending = {}
+    try:
+        yield
+    finally:
+        pending, _batch.pending = _batch.pending, None
+        for tier, keys in pending.items():
+            tier.publish(keys)
+
+
+class CacheBatchMiddleware:
+    """Копит изменения ключей кеша за запрос."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with batched():
+            return self.get_response(request)
+
+
+def prune_invalidations():
+    """Удаляет изменения ключей старше CACHE_INVALIDATION_RETENTION."""
+    deleted, _ = CacheInvalidation.objects.filter(
+        created_at__lt=timezone.now() - timedelta(
+            seconds=CACHE_INVALIDATION_RETENTION
+        )
+    ).delete()
+    return deleted
+
+
+def bump(key):
+    """Меняет версию, входящую в ключи зависимых значений."""
+    caches['default'].set(key, time.time_ns(), None)
+
+
+def version_of(key):
+    return caches['default'].get_or_set(key, time.time_ns, None)
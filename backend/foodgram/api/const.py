@@ -8,3 +8,83 @@ MEASUREMENT_UNIT_MAX_LENGTH: int = 64
 RECIPES_NAME_MAX_LENGTH: int = 256
 SHORT_LINK_DB: int = 32
 CHARACTERS: str = 'ABCDEFGHJKLMNOPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz234567890'
+# Константы для фоновых задач
+JOB_KIND_MAX_LENGTH: int = 64
+JOB_DEDUP_KEY_LENGTH: int = 64
+JOB_TIMEOUT: int = 600
+JOB_MAX_ATTEMPTS: int = 3
+JOB_POLL_INTERVAL: float = 1.0
+JOB_WORKERS: int = 2
+# Столько секунд после завершения задачи хранится файл результата
+JOB_RESULT_TTL: int = 24 * 3600
+# Начиная с этого количества рецептов список покупок выгружается в фоне
+EXPORT_ASYNC_MIN_RECIPES: int = 20
+# Константы для ленты подписок
+FEED_PAGE_SIZE: int = 10
+FEED_MAX_PAGE_SIZE: int = 100
+FEED_BATCH_SIZE: int = 1000
+FEED_BACKFILL_RECIPES: int = 50
+# До этого числа подписчиков лента раскладывается прямо в запросе
+FEED_FANOUT_INLINE_FOLLOWERS: int = 200
+# Свыше этого числа подписчиков рецепты подмешиваются в ленту при чтении
+FEED_FANOUT_MAX_FOLLOWERS: int = 10000
+# Константы для похожих рецептов
+SIMILAR_RECIPES_TOP_K: int = 10
+SIMILAR_RECIPES_BLOCK_SIZE: int = 256
+SIMILAR_RECIPES_TAG_WEIGHT: float = 0.5
+# Константы для поиска по имеющимся ингредиентам
+PANTRY_INDEX_REFRESH: int = 5
+PANTRY_INDEX_REBUILD: int = 600
+PANTRY_MAX_INGREDIENTS: int = 100
+# Константы для выдачи нескольких рецептов по id
+BATCH_MAX_RECIPES: int = 100
+# Константы для ограничения нагрузки
+CONCURRENCY_SLOT_TTL: int = 120
+CONCURRENCY_RETRY_AFTER: int = 1
+# Константы для сроков выполнения запросов
+# SQLite проверяет срок через столько инструкций виртуальной машины
+DEADLINE_PROGRESS_STEPS: int = 1000
+# Через столько секунд клиенту предлагается повторить запрос
+DEADLINE_RETRY_AFTER: int = 5
+# Константы для профилирования запросов
+PROFILE_RING_SIZE: int = 50
+PROFILE_SAMPLE_INTERVAL: float = 0.005
+PROFILE_TOKEN_MAX_AGE: int = 3600
+# Константы для журнала медленных запросов
+SLOW_QUERY_LOG_MAX_BYTES: int = 10 * 1024 * 1024
+# Константы для хранилища медиафайлов
+MEDIA_GC_BATCH_SIZE: int = 1000
+# Файлы моложе этого числа секунд не удаляются: ссылка на только что
+# сохранённый файл может быть ещё не зафиксирована в базе
+MEDIA_GC_GRACE: int = 3600
+# Константы для двухуровневого кеша
+# Запись живёт в памяти процесса не дольше этого числа секунд
+CACHE_L1_TTL: int = 30
+# Вне запросов изменения ключей читаются не чаще раза в секунду
+CACHE_SYNC_INTERVAL: int = 1
+# Изменения ключей хранятся столько секунд; воркер, не читавший их
+# дольше, очищает свой кеш целиком
+CACHE_INVALIDATION_RETENTION: int = 600
+# Константы для синхронизации клиентов
+SYNC_PAGE_SIZE: int = 500
+# Журнал изменений хранится столько секунд, более старый токен
+# требует полной загрузки
+CHANGE_LOG_RETENTION: int = 30 * 24 * 3600
+# Пространство ключей рекомендательных блокировок PostgreSQL для журнала
+SYNC_LOCK_NAMESPACE: int = 4501
+# Константы для единственного пересчета кеша
+# Держатель аренды пересчитывает значение не дольше этого числа секунд
+CACHE_LEASE_TTL: int = 10
+# Ожидающий без устаревшего значения ждет не дольше этого числа секунд,
+# опрашивая общий кеш с удваивающейся паузой
+CACHE_LEASE_WAIT: float = 0.5
+CACHE_LEASE_POLL: float = 0.02
+CACHE_LEASE_POLL_MAX: float = 0.2
+# Столько секунд после истечения значение отдается, пока идет пересчет
+CACHE_STALE_TTL: int = 60
+CACHE_EARLY_REFRESH_BETA: float = 1.0
+RECIPE_LIST_CACHE_TTL: int = 10
+REFERENCE_CACHE_TTL: int = 3600
+SHORT_LINK_CACHE_TTL: int = 24 * 60 * 60
+# Константы для избранного и корзины пользователя
+MEMBERSHIP_CACHE_TTL: int = 300
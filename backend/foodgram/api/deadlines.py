@@ -0,0 +1,147 @@
+"""Срок выполнения тяжелых действий API.
+
+Пока действие выполняется, PostgreSQL отменяет запрос к базе дольше
+срока (statement_timeout), SQLite прерывает запрос, идущий после срока
+(обработчик прогресса), а новые запросы после срока не начинаются.
+Клиент получает 503 со временем выполнения, соединение освобождается
+сразу, а не после таймаута воркера gunicorn.
+
+statement_timeout задается на сессию и сбрасывается после действия, а
+не через SET LOCAL в транзакции запроса: запросы выполняются в
+автокоммите, и аренды общего кеша (api.cache) должны быть видны другим
+воркерам сразу.
+
+Уборка после действия (освобождение аренды кеша) выполняется в
+suspended(): иначе после срока она не прошла бы, и аренда держалась бы
+до CACHE_LEASE_TTL.
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import DatabaseError, OperationalError, connection
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from api.const import DEADLINE_PROGRESS_STEPS, DEADLINE_RETRY_AFTER
+
+# SQLSTATE query_canceled: запрос отменен по statement_timeout.
+QUERY_CANCELED = '57014'
+
+
+class DeadlineExceeded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Запрос выполняется слишком долго, повторите позже.'
+    default_code = 'deadline_exceeded'
+
+    def __init__(self, deadline):
+        super().__init__()
+        self.wait = DEADLINE_RETRY_AFTER
+        # Числа отдаются числами, а не строками ErrorDetail.
+        self.detail = {
+            'detail': self.default_detail,
+            'deadline_ms': round(deadline.seconds * 1000),
+            'elapsed_ms': round(deadline.elapsed() * 1000),
+            'db_ms': round(deadline.db_time * 1000),
+            'queries': deadline.queries,
+        }
+
+
+class Deadline:
+    """Обертка запросов к базе, которая следит за сроком."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.start = time.monotonic()
+        self.queries = 0
+        self.db_time = 0.0
+        self.paused = 0
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def expired(self):
+        return self.elapsed() >= self.seconds
+
+    def interrupt(self):
+        return not self.paused and self.expired()
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.paused:
+            return execute(sql, params, many, context)
+        if self.expired():
+            raise DeadlineExceeded(self)
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if not canceled(error):
+                raise
+            cancel = error
+        finally:
+            self.queries += 1
+            self.db_time += time.monotonic() - start
+        raise DeadlineExceeded(self) from cancel
+
+
+def canceled(error):
+    cause = error.__cause__
+    return (
+        getattr(cause, 'pgcode', None) == QUERY_CANCELED
+        or str(cause) == 'interrupted'
+    )
+
+
+def execute_raw(sql, params=()):
+    # Служебный запрос идет мимо оберток и не считается запросом действия.
+    with connection.wrap_database_errors:
+        with connection.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+@contextmanager
+def deadline(seconds):
+    """Ограничивает запросы к базе внутри блока сроком seconds."""
+    tracker = Deadline(seconds)
+    connection.ensure_connection()
+    if connection.vendor == 'postgresql':
+        execute_raw(
+            'SET statement_timeout = %s', (max(1, round(seconds * 1000)),)
+        )
+    elif connection.vendor == 'sqlite':
+        connection.connection.set_progress_handler(
+            tracker.interrupt, DEADLINE_PROGRESS_STEPS
+        )
+    try:
+        with connection.execute_wrapper(tracker):
+            yield tracker
+    finally:
+        reset()
+
+
+@contextmanager
+def suspended():
+    """Выполняет запросы внутри блока без проверки срока."""
+    trackers = [
+        wrapper for wrapper in connection.execute_wrappers
+        if isinstance(wrapper, Deadline)
+    ]
+    for tracker in trackers:
+        tracker.paused += 1
+    try:
+        yield
+    finally:
+        for tracker in trackers:
+            tracker.paused -= 1
+
+
+def reset():
+    if connection.connection is None:
+        return
+    if connection.vendor == 'sqlite':
+        connection.connection.set_progress_handler(None, 0)
+    elif connection.vendor == 'postgresql':
+        try:
+            execute_raw('RESET statement_timeout')
+        except DatabaseError:
+            # Соединение со сроком нельзя отдавать следующему запросу.
+            connection.close()
@@ -0,0 +1,94 @@
+"""Лента рецептов от авторов, на которых подписан пользователь.
+
+Новый рецепт раскладывается в таблицу TimelineEntry подписчиков
+автора (fan-out-on-write), поэтому чтение ленты - один проход по
+индексу (user, recipe). Рецепты авторов с огромным числом подписчиков
+не раскладываются: при публикации они помечаются fan_out_on_read и
+подмешиваются при чтении одним запросом по частичному индексу.
+"""
+from api.const import (
+    FEED_BACKFILL_RECIPES,
+    FEED_BATCH_SIZE,
+    FEED_FANOUT_INLINE_FOLLOWERS,
+    FEED_FANOUT_MAX_FOLLOWERS,
+)
+from jobs.queue import enqueue
+from recipes.models import Recipe, TimelineEntry
+from users.models import Subscription
+
+FEED_FAN_OUT = 'feed_fan_out'
+
+
+def followers_count(author, limit):
+    """Количество подписчиков автора, но не больше limit."""
+    return Subscription.objects.filter(following=author)[:limit].count()
+
+
+def write_timeline(recipe):
+    """Добавляет рецепт в ленты всех подписчиков автора."""
+    followers = Subscription.objects.filter(
+        following_id=recipe.author_id
+    ).values_list('user_id', flat=True).order_by('id')
+    batch = []
+    for user_id in followers.iterator(chunk_size=FEED_BATCH_SIZE):
+        batch.append(TimelineEntry(user_id=user_id, recipe=recipe))
+        if len(batch) >= FEED_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(recipe):
+    """Раскладывает новый рецепт по лентам подписчиков.
+
+    Небольшие аудитории обрабатываются сразу, большие - фоновой
+    задачей, а для самых популярных авторов раскладка не нужна.
+    """
+    count = followers_count(recipe.author, FEED_FANOUT_MAX_FOLLOWERS + 1)
+    if count > FEED_FANOUT_MAX_FOLLOWERS:
+        Recipe.objects.filter(pk=recipe.pk).update(fan_out_on_read=True)
+        return
+    if count > FEED_FANOUT_INLINE_FOLLOWERS:
+        enqueue(FEED_FAN_OUT, payload={'recipe': recipe.id})
+        return
+    write_timeline(recipe)
+
+
+def backfill(user, author):
+    """Заполняет ленту последними разложенными рецептами нового автора."""
+    recipes = Recipe.objects.filter(
+        author=author, fan_out_on_read=False
+    ).order_by('-id').values_list('id', flat=True)[:FEED_BACKFILL_RECIPES]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user=user, recipe_id=recipe) for recipe in recipes],
+        ignore_conflicts=True,
+    )
+
+
+def forget(user, author):
+    """Убирает из ленты рецепты автора после отписки."""
+    TimelineEntry.objects.filter(user=user, recipe__author=author).delete()
+
+
+def feed_recipe_ids(user, before=None, limit=FEED_BACKFILL_RECIPES):
+    """Идентификаторы рецептов ленты по убыванию, строго меньше before."""
+    entries = TimelineEntry.objects.filter(user=user)
+    if before is not None:
+        entries = entries.filter(recipe_id__lt=before)
+    ids = list(
+        entries.order_by('-recipe_id').values_list(
+            'recipe_id', flat=True
+        )[:limit]
+    )
+    pulled = Recipe.objects.filter(
+        fan_out_on_read=True,
+        author__in=Subscription.objects.filter(user=user).values(
+            'following_id'
+        ),
+    )
+    if before is not None:
+        pulled = pulled.filter(id__lt=before)
+    pulled = list(pulled.order_by('-id').values_list('id', flat=True)[:limit])
+    if pulled:
+        ids = sorted(set(ids).union(pulled), reverse=True)[:limit]
+    return ids
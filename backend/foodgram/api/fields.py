@@ -2,6 +2,7 @@ import base64
 
 from django.core.files.base import ContentFile
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
 
 class Base64ImageField(serializers.ImageField):
@@ -13,3 +14,58 @@ class Base64ImageField(serializers.ImageField):
             data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
 
         return super().to_internal_value(data)
+
+
+class ReferenceManyRelatedField(serializers.ManyRelatedField):
+    """Список связей, все неизвестные id попадают в одну ошибку."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_many(data)
+
+
+class ReferenceRelatedField(serializers.PrimaryKeyRelatedField):
+    """Связь со справочником, которая проверяется по кешу без запросов."""
+    default_error_messages = {
+        'does_not_exist_many': (
+            'Недопустимые первичные ключи {pk_values} - объекты не '
+            'существуют.'
+        ),
+    }
+
+    def __init__(self, lookup, **kwargs):
+        self.lookup = lookup
+        super().__init__(**kwargs)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return ReferenceManyRelatedField(**list_kwargs)
+
+    def resolve(self, data):
+        """Объект справочника или None; ошибка для нечисловых id."""
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.lookup(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def to_internal_value(self, data):
+        obj = self.resolve(data)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+    def to_internal_value_many(self, data):
+        objects = [(value, self.resolve(value)) for value in data]
+        unknown = [str(value) for value, obj in objects if obj is None]
+        if unknown:
+            self.fail('does_not_exist_many', pk_values=', '.join(unknown))
+        return [obj for _, obj in objects]
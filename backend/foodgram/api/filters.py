@@ -1,22 +1,20 @@
+from django.db.models import Exists, OuterRef
 from django_filters import FilterSet, filters
-from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe, Tag, Ingredient
-
-
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+from api.membership import LISTS, memberships
+from recipes.models import Favorite, Recipe, ShoppingCart
+from recipes.reference import reference
 
 
 class RecipesFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    """Фильтры рецептов без соединений и DISTINCT.
+
+    Теги проверяются через EXISTS, избранное и корзина - по id из
+    множеств пользователя (api.membership).
+    """
+    tags = filters.MultipleChoiceFilter(
+        choices=reference.tag_choices,
+        method='filter_tags',
     )
     is_favorited = filters.NumberFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.NumberFilter(
@@ -32,16 +30,30 @@ class RecipesFilter(FilterSet):
             'is_in_shopping_cart'
         )
 
+    def filter_tags(self, queryset, name, value):
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    tag_id__in=reference.tag_ids(value),
+                    recipe_id=OuterRef('pk'),
+                )
+            )
+        )
+
+    def filter_user_list(self, queryset, model, value):
+        user = self.request.user
+        # У анонима списков нет: value=0 ничего не отсекает.
+        if value not in (0, 1) or not user.is_authenticated:
+            return queryset
+        ids = memberships(user)[LISTS[model]]
+        if not ids:
+            return queryset.none() if value else queryset
+        if value:
+            return queryset.filter(id__in=ids)
+        return queryset.exclude(id__in=ids)
+
     def filter_is_favorited(self, queryset, name, value):
-        if value == 1 and self.request.user.is_authenticated:
-            return queryset.filter(favorites__user=self.request.user)
-        elif value == 0:
-            return queryset.exclude(favorites__user=self.request.user)
-        return queryset
+        return self.filter_user_list(queryset, Favorite, value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        if value == 1 and self.request.user.is_authenticated:
-            return queryset.filter(shopping_list__user=self.request.user)
-        elif value == 0:
-            return queryset.exclude(shopping_list__user=self.request.user)
-        return queryset
+        return self.filter_user_list(queryset, ShoppingCart, value)
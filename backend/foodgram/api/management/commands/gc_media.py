@@ -0,0 +1,79 @@
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.const import MEDIA_GC_BATCH_SIZE, MEDIA_GC_GRACE
+from api.storage import CONTENT_ADDRESSED_DIRS, referenced
+
+
+class Command(BaseCommand):
+    help = 'Удаляет медиафайлы, на которые не ссылается ни одна запись'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, сколько файлов будет удалено',
+        )
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=MEDIA_GC_GRACE,
+            help='Не трогать файлы моложе этого числа секунд',
+        )
+
+    def walk(self, deadline):
+        """Имена и размеры файлов старше deadline, без чтения в память."""
+        for directory in CONTENT_ADDRESSED_DIRS:
+            root = default_storage.path(directory)
+            for path, _, files in os.walk(root):
+                for file in files:
+                    full_path = os.path.join(path, file)
+                    try:
+                        stat = os.stat(full_path)
+                    except FileNotFoundError:
+                        continue
+                    if stat.st_mtime < deadline:
+                        yield '/'.join((
+                            directory,
+                            os.path.relpath(full_path, root).replace(
+                                os.sep, '/'
+                            ),
+                        )), stat.st_size
+
+    def batches(self, files):
+        batch = {}
+        for name, size in files:
+            batch[name] = size
+            if len(batch) >= MEDIA_GC_BATCH_SIZE:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
+
+    def handle(self, *args, **options):
+        deadline = time.time() - options['grace']
+        checked = deleted = freed = 0
+        for batch in self.batches(self.walk(deadline)):
+            checked += len(batch)
+            orphans = set(batch) - referenced(batch)
+            for name in orphans:
+                if not options['dry_run']:
+                    try:
+                        # Файл могли загрузить заново после обхода каталога.
+                        if os.path.getmtime(
+                            default_storage.path(name)
+                        ) >= deadline:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    default_storage.delete(name)
+                deleted += 1
+                freed += batch[name]
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {checked}. {action}: {deleted}, '
+            f'{freed / 1024 / 1024:.1f} МБ.'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.const import PROFILE_TOKEN_MAX_AGE
+from api.profiling import CPROFILE, MODES, make_token
+
+
+class Command(BaseCommand):
+    help = (
+        'Выдает значение заголовка X-Profile для профилирования запросов '
+        f'без входа сотрудником, действует {PROFILE_TOKEN_MAX_AGE} с'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES, default=CPROFILE)
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token(options['mode']))
@@ -0,0 +1,82 @@
+import json
+import re
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from api.slow_queries import log_paths
+
+# Списки IN разной длины относятся к одному и тому же запросу.
+IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+
+def normalize(sql):
+    return IN_LIST.sub('(%s, ...)', sql)
+
+
+class Command(BaseCommand):
+    help = 'Сводка журнала медленных запросов по суммарному времени'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument(
+            '--plans',
+            action='store_true',
+            help='Показать последний снятый план каждого запроса',
+        )
+
+    def read_entries(self):
+        for path in log_paths():
+            try:
+                with open(path, encoding='utf-8') as file:
+                    for line in file:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue
+            except FileNotFoundError:
+                continue
+
+    def handle(self, *args, **options):
+        groups = {}
+        for entry in self.read_entries():
+            group = groups.setdefault(normalize(entry['sql']), {
+                'count': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'views': Counter(),
+                'call_sites': Counter(),
+                'plan': None,
+            })
+            group['count'] += 1
+            group['total'] += entry['duration_ms']
+            group['max'] = max(group['max'], entry['duration_ms'])
+            group['views'][entry.get('view')] += 1
+            group['call_sites'][entry.get('call_site')] += 1
+            if entry.get('plan'):
+                group['plan'] = entry['plan']
+        if not groups:
+            self.stdout.write('Медленных запросов не записано.')
+            return
+        top = sorted(
+            groups.items(), key=lambda item: item[1]['total'], reverse=True
+        )[:options['top']]
+        for number, (sql, group) in enumerate(top, 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{number}. всего {group["total"]:.0f} мс, '
+                f'{group["count"]} раз, среднее '
+                f'{group["total"] / group["count"]:.1f} мс, '
+                f'максимум {group["max"]:.1f} мс'
+            ))
+            self.stdout.write(sql)
+            for label, counter in (
+                ('Вьюхи', group['views']),
+                ('Места вызова', group['call_sites']),
+            ):
+                self.stdout.write(f'{label}: ' + ', '.join(
+                    f'{name} ({count})'
+                    for name, count in counter.most_common(3)
+                ))
+            if options['plans'] and group['plan']:
+                self.stdout.write(group['plan'])
+            self.stdout.write('')
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+
+from api.views import RecipeViewset
+from recipes.reference import reference
+
+# Первая страница главной, как ее запрашивает фронтенд.
+DEFAULT_PATHS = ('/api/recipes/?page=1&limit=6',)
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет кеш справочников и страниц списка рецептов до приема '
+        'запросов, чтобы первый пересчет не ждали все воркеры'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--host',
+            action='append',
+            default=[],
+            help='Хост из адреса запроса (по умолчанию ALLOWED_HOSTS)',
+        )
+        parser.add_argument(
+            '--path',
+            action='append',
+            default=[],
+            help='Адрес страницы списка рецептов с параметрами',
+        )
+
+    def handle(self, *args, **options):
+        reference.ensure_fresh()
+        hosts = options['host'] or [
+            host for host in settings.ALLOWED_HOSTS
+            if host != '*' and not host.startswith('.')
+        ]
+        if not hosts:
+            raise CommandError('Укажите --host или ALLOWED_HOSTS.')
+        view = RecipeViewset.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        for host in hosts:
+            for path in options['path'] or DEFAULT_PATHS:
+                response = view(factory.get(path, HTTP_HOST=host))
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f'{host}{path} вернул {response.status_code}'
+                    )
+                self.stdout.write(f'{host}{path}')
+        self.stdout.write(self.style.SUCCESS('Кеш заполнен'))
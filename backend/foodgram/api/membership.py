@@ -0,0 +1,52 @@
+"""Множества рецептов в избранном и корзине пользователя.
+
+Хранятся в кеше по ключу пользователя и загружаются одним запросом.
+Любое сохранение или удаление Favorite и ShoppingCart удаляет ключ
+после фиксации транзакции (recipes.signals), следующий запрос загружает
+множества заново. Менять закешированное множество на месте нельзя:
+одновременные запросы затирали бы изменения друг друга.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, Value
+
+from api.const import MEMBERSHIP_CACHE_TTL
+from recipes.models import Favorite, ShoppingCart
+
+FAVORITES = 'favorites'
+SHOPPING_CART = 'shopping_cart'
+LISTS = {Favorite: FAVORITES, ShoppingCart: SHOPPING_CART}
+
+
+def cache_key(user_id):
+    return f'membership:{user_id}'
+
+
+def membership_query(user_id):
+    return Favorite.objects.filter(user_id=user_id).annotate(
+        list=Value(FAVORITES, output_field=CharField())
+    ).values_list('list', 'recipes_id').union(
+        ShoppingCart.objects.filter(user_id=user_id).annotate(
+            list=Value(SHOPPING_CART, output_field=CharField())
+        ).values_list('list', 'recipes_id'),
+        all=True,
+    )
+
+
+def load(user_id):
+    lists = {name: set() for name in LISTS.values()}
+    for name, recipe_id in membership_query(user_id):
+        lists[name].add(recipe_id)
+    return {name: frozenset(ids) for name, ids in lists.items()}
+
+
+def memberships(user):
+    """{'favorites': frozenset(id), 'shopping_cart': frozenset(id)}."""
+    return cache.get_or_set(
+        cache_key(user.id), lambda: load(user.id), MEMBERSHIP_CACHE_TTL
+    )
+
+
+def forget(user_id):
+    """Сбрасывает множества пользователя после фиксации транзакции."""
+    transaction.on_commit(lambda: cache.delete(cache_key(user_id)))
@@ -0,0 +1,126 @@
+"""Метрики приложения в формате Prometheus.
+
+Воркеры gunicorn пишут значения в файлы каталога
+PROMETHEUS_MULTIPROC_DIR, эндпоинт /api/metrics суммирует их через
+MultiProcessCollector. Каталог задается и очищается при старте
+gunicorn (gunicorn.conf.py); без него (runserver, команды) метрики
+собираются в памяти процесса.
+
+Эндпоинт отдает метрики только с заголовком Authorization: Bearer
+<METRICS_TOKEN>; если токен не задан, метрики закрыты.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+UNMATCHED = 'unmatched'
+
+REQUEST_LATENCY = Histogram(
+    'foodgram_request_latency_seconds',
+    'Время обработки запроса',
+    ('view', 'method', 'status'),
+)
+RESPONSE_SIZE = Histogram(
+    'foodgram_response_size_bytes',
+    'Размер тела ответа',
+    ('view',),
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries_per_request',
+    'Количество запросов к базе за запрос',
+    ('view',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+DB_TIME = Histogram(
+    'foodgram_db_time_seconds',
+    'Время запросов к базе за запрос',
+    ('view',),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests_total',
+    'Обращения к кешам приложения',
+    ('cache', 'result'),
+)
+
+
+def view_name(view_func, method):
+    """RecipeViewset.list для вьюсетов, имя функции для остальных."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return view_func.__name__
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+    return f'{cls.__name__}.{action}' if action else cls.__name__
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """Время, размер ответа и запросы к базе по имени вьюхи."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        view = getattr(request, 'metrics_view', UNMATCHED)
+        REQUEST_LATENCY.labels(
+            view, request.method, response.status_code
+        ).observe(time.perf_counter() - start)
+        if response.streaming:
+            size = response.get('Content-Length')
+        else:
+            size = len(response.content)
+        if size is not None:
+            RESPONSE_SIZE.labels(view).observe(int(size))
+        DB_QUERIES.labels(view).observe(queries.count)
+        DB_TIME.labels(view).observe(queries.time)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_name(view_func, request.method)
+
+
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    if not token or (
+        request.headers.get('Authorization') != f'Bearer {token}'
+    ):
+        return HttpResponseForbidden()
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST
+    )
@@ -1,7 +1,112 @@
+from django.conf import settings
 from rest_framework import viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import ListSerializer
 
+from api.deadlines import deadline
 from api.pagination import CustomPagination
+from api.throttling import Overloaded, store
 
 
 class PaginationMixins(viewsets.GenericViewSet):
     pagination_class = CustomPagination
+
+
+class ConcurrencyLimitMixin:
+    """Ограничивает число одновременно выполняемых тяжелых действий.
+
+    concurrency_limits связывает действие с пулом из
+    settings.CONCURRENCY_LIMITS. Если свободных слотов нет, запрос
+    сразу получает 503 с Retry-After, а не ждет в очереди.
+    """
+    concurrency_limits = {}
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        pool = self.concurrency_limits.get(self.action)
+        if pool is None:
+            return
+        self.concurrency_slot = store.acquire(
+            pool, settings.CONCURRENCY_LIMITS[pool]
+        )
+        if self.concurrency_slot is None:
+            raise Overloaded()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        slot = getattr(self, 'concurrency_slot', None)
+        if slot is not None:
+            store.release(slot)
+            self.concurrency_slot = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class DeadlineMixin:
+    """Ограничивает время выполнения тяжелых действий.
+
+    deadlines связывает действие со сроком из settings.REQUEST_DEADLINES
+    в секундах. Запросы к базе после срока прерываются, клиент получает
+    503 с временем выполнения (api.deadlines).
+    """
+    deadlines = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        # self.action появляется только внутри dispatch.
+        name = self.deadlines.get(
+            (getattr(self, 'action_map', None) or {}).get(
+                request.method.lower()
+            )
+        )
+        if name is None:
+            return super().dispatch(request, *args, **kwargs)
+        with deadline(settings.REQUEST_DEADLINES[name]):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class SparseFieldsetMixin:
+    """Параметры ?fields= и ?omit= для GET-запросов вьюсета.
+
+    Выбранные поля передаются в контекст сериализатора как
+    sparse_fields, сериализаторы с SparseFieldsSerializerMixin отдают
+    и вычисляют только их.
+    """
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request is not None and self.request.method == 'GET':
+            params = self.request.query_params
+            only, omit = params.get('fields'), params.get('omit')
+            context['sparse_fields'] = (
+                {name for name in only.split(',') if name}
+                if only is not None else None,
+                {name for name in (omit or '').split(',') if name},
+            )
+        return context
+
+    def requested_fields(self, serializer_class):
+        """Поля, которые попадут в ответ."""
+        return set(serializer_class(
+            context=self.get_serializer_context()
+        ).fields)
+
+
+class SparseFieldsSerializerMixin:
+    """Оставляет поля из sparse_fields контекста."""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, ListSerializer):
+            parent = parent.parent
+        # Вложенные сериализаторы отдаются целиком.
+        if parent is not None:
+            return fields
+        only, omit = self.context.get('sparse_fields', (None, set()))
+        unknown = ((only or set()) | omit) - set(fields)
+        if unknown:
+            raise ValidationError({
+                'fields': 'Неизвестные поля: ' + ', '.join(sorted(unknown))
+            })
+        return {
+            name: field for name, field in fields.items()
+            if (only is None or name in only) and name not in omit
+        }
@@ -1,5 +1,64 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import (
+    BasePagination,
+    PageNumberPagination,
+    _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from api.const import FEED_MAX_PAGE_SIZE, FEED_PAGE_SIZE
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class FeedPagination(BasePagination):
+    """Курсорная пагинация ленты по убыванию id рецепта."""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = FEED_PAGE_SIZE
+    max_page_size = FEED_MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return None
+        try:
+            return _positive_int(cursor, strict=True)
+        except (ValueError, DjangoValidationError):
+            raise ValidationError(
+                {self.cursor_query_param: 'Неверный курсор.'}
+            )
+
+    def paginate_ids(self, request, fetch):
+        """Возвращает страницу id, полученную от fetch(before, limit)."""
+        self.request = request
+        limit = self.get_page_size(request)
+        ids = fetch(self.get_cursor(request), limit)
+        self.next_cursor = ids[-1] if len(ids) == limit else None
+        return ids
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
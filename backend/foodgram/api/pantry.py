@@ -0,0 +1,169 @@
+"""Поиск рецептов по имеющимся у пользователя ингредиентам.
+
+Инвертированный индекс ингредиент -> отсортированный массив id рецептов
+строится из ArrayIngredient и хранится в памяти процесса. Рецепты,
+сохраненные в этом процессе, обновляются в индексе сразу; изменения из
+других воркеров подтягиваются по Recipe.updated_at, удаления - по
+журналу изменений, не чаще, чем раз в PANTRY_INDEX_REFRESH секунд.
+Раз в PANTRY_INDEX_REBUILD секунд индекс перестраивается целиком в
+фоновом потоке, запросы тем временем читают прежний.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection
+from django.utils import timezone
+
+from api.const import PANTRY_INDEX_REBUILD, PANTRY_INDEX_REFRESH
+from api.metrics import CACHE_REQUESTS
+from recipes.models import ArrayIngredient, ChangeLog
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+class PantryIndex:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings = {}
+        self.recipes = {}
+        self.synced_at = None
+        self.built = 0.0
+        self.checked = 0.0
+        self.rebuilding = False
+
+    def build(self):
+        """Полностью перестраивает индекс."""
+        started_at = timezone.now()
+        postings = defaultdict(list)
+        recipes = defaultdict(list)
+        pairs = ArrayIngredient.objects.order_by(
+            'ingredients_id', 'recipes_id'
+        ).values_list('ingredients_id', 'recipes_id').iterator()
+        for ingredient_id, recipe_id in pairs:
+            postings[ingredient_id].append(recipe_id)
+            recipes[recipe_id].append(ingredient_id)
+        with self.lock:
+            self.postings = {
+                ingredient_id: np.asarray(ids, dtype=np.int64)
+                for ingredient_id, ids in postings.items()
+            }
+            self.recipes = {
+                recipe_id: frozenset(ids) for recipe_id, ids in recipes.items()
+            }
+            self.synced_at = started_at
+            self.built = self.checked = time.monotonic()
+
+    def rebuild_in_background(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+        CACHE_REQUESTS.labels('pantry_index', 'rebuild').inc()
+        threading.Thread(target=self.background_build, daemon=True).start()
+
+    def background_build(self):
+        try:
+            self.build()
+        finally:
+            self.rebuilding = False
+            # У потока свое соединение с базой.
+            connection.close()
+
+    def remove(self, recipe_id):
+        with self.lock:
+            for ingredient_id in self.recipes.pop(recipe_id, ()):
+                ids = self.postings.get(ingredient_id, EMPTY)
+                position = np.searchsorted(ids, recipe_id)
+                # Списки могли разойтись с recipes: удаляем только сам id.
+                if position < len(ids) and ids[position] == recipe_id:
+                    self.postings[ingredient_id] = np.delete(ids, position)
+
+    def update(self, recipe_id, ingredient_ids):
+        """Заменяет ингредиенты рецепта в индексе."""
+        with self.lock:
+            self.remove(recipe_id)
+            ingredient_ids = frozenset(ingredient_ids)
+            if not ingredient_ids:
+                return
+            self.recipes[recipe_id] = ingredient_ids
+            for ingredient_id in ingredient_ids:
+                ids = self.postings.get(ingredient_id, EMPTY)
+                position = np.searchsorted(ids, recipe_id)
+                if position < len(ids) and ids[position] == recipe_id:
+                    continue
+                self.postings[ingredient_id] = np.insert(
+                    ids, position, recipe_id
+                )
+
+    def refresh(self):
+        """Подтягивает рецепты, измененные и удаленные в других процессах."""
+        now = time.monotonic()
+        if self.synced_at is None:
+            CACHE_REQUESTS.labels('pantry_index', 'miss').inc()
+            return self.build()
+        if now - self.built > PANTRY_INDEX_REBUILD:
+            self.rebuild_in_background()
+        if now - self.checked < PANTRY_INDEX_REFRESH:
+            CACHE_REQUESTS.labels('pantry_index', 'hit').inc()
+            return
+        CACHE_REQUESTS.labels('pantry_index', 'refresh').inc()
+        started_at = timezone.now()
+        # Запас на расхождение часов между процессами.
+        since = self.synced_at - timedelta(seconds=PANTRY_INDEX_REFRESH)
+        changed = defaultdict(list)
+        for recipe_id, ingredient_id in ArrayIngredient.objects.filter(
+            recipes__updated_at__gte=since
+        ).values_list('recipes_id', 'ingredients_id'):
+            changed[recipe_id].append(ingredient_id)
+        deleted = ChangeLog.objects.filter(
+            kind=ChangeLog.RECIPE, deleted=True, created_at__gte=since
+        ).values_list('object_id', flat=True)
+        with self.lock:
+            for recipe_id, ingredient_ids in changed.items():
+                self.update(recipe_id, ingredient_ids)
+            for recipe_id in deleted:
+                self.remove(recipe_id)
+            self.synced_at = started_at
+            self.checked = now
+
+    def rank(self, ingredient_ids, allowed=None):
+        """Рецепты, в которых есть хотя бы один из ингредиентов.
+
+        Возвращает словарь id -> (доля имеющихся ингредиентов, число
+        недостающих), упорядоченный по убыванию покрытия и возрастанию
+        числа недостающих. allowed ограничивает набор рецептов.
+        """
+        self.refresh()
+        if allowed is not None:
+            allowed = np.fromiter(allowed, dtype=np.int64)
+        with self.lock:
+            lists = [
+                self.postings[ingredient_id]
+                for ingredient_id in set(ingredient_ids)
+                if ingredient_id in self.postings
+            ]
+            if not lists:
+                return {}
+            ids, hits = np.unique(np.concatenate(lists), return_counts=True)
+            if allowed is not None:
+                keep = np.isin(ids, allowed)
+                ids, hits = ids[keep], hits[keep]
+            sizes = np.fromiter(
+                (len(self.recipes[recipe_id]) for recipe_id in ids.tolist()),
+                dtype=np.int64,
+                count=len(ids),
+            )
+        coverage = hits / sizes
+        missing = sizes - hits
+        order = np.lexsort((-ids, missing, -coverage))
+        return dict(zip(
+            ids[order].tolist(),
+            zip(coverage[order].tolist(), missing[order].tolist()),
+        ))
+
+
+index = PantryIndex()
@@ -0,0 +1,148 @@
+"""Профилирование отдельных запросов по заголовку X-Profile.
+
+Профилирование включается настройкой PROFILER_ENABLED; без нее
+middleware исключается из цепочки при старте и ничего не стоит.
+Запрос профилируется, если в X-Profile передан токен из команды
+profile_token или режим, а запрос сделан сотрудником. Режимы:
+cprofile - детерминированный профиль в формате pstats,
+sample - периодические снимки стека в свернутом формате для
+flamegraph.pl и speedscope. Профили хранятся в PROFILER_DIR, остаются
+последние PROFILE_RING_SIZE, ссылка на профиль возвращается в
+заголовке X-Profile-Url.
+"""
+import cProfile
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import reverse
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.const import (
+    PROFILE_RING_SIZE,
+    PROFILE_SAMPLE_INTERVAL,
+    PROFILE_TOKEN_MAX_AGE,
+)
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+MODES = {CPROFILE: 'pstats', SAMPLE: 'collapsed'}
+SIGNING_SALT = 'api.profiling'
+
+
+def make_token(mode=CPROFILE):
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign(mode)
+
+
+def profile_path(name):
+    """Путь к профилю по имени файла; None для чужих имен."""
+    stem, _, extension = name.partition('.')
+    if extension not in MODES.values() or not stem.isalnum():
+        return None
+    return os.path.join(settings.PROFILER_DIR, name)
+
+
+class Sampler(threading.Thread):
+    """Снимает стек потока запроса каждые interval секунд."""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while True:
+            self.sample()
+            if self.stopped.wait(self.interval):
+                return
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(
+                f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+            )
+            frame = frame.f_back
+        if stack:
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+class ProfilerMiddleware:
+
+    def __init__(self, get_response):
+        if not settings.PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+
+    def __call__(self, request):
+        header = request.headers.get('X-Profile')
+        mode = self.get_mode(request, header) if header else None
+        if mode is None:
+            return self.get_response(request)
+        name = f'{time.time_ns():020d}{uuid.uuid4().hex[:8]}.{MODES[mode]}'
+        path = os.path.join(settings.PROFILER_DIR, name)
+        if mode == CPROFILE:
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+            profiler.dump_stats(path)
+        else:
+            sampler = Sampler(threading.get_ident())
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+            sampler.dump(path)
+        self.trim()
+        response['X-Profile-Url'] = request.build_absolute_uri(
+            reverse('api:profile', args=(name,))
+        )
+        return response
+
+    def get_mode(self, request, header):
+        try:
+            return signing.TimestampSigner(salt=SIGNING_SALT).unsign(
+                header, max_age=PROFILE_TOKEN_MAX_AGE
+            )
+        except signing.BadSignature:
+            pass
+        if header not in MODES:
+            return None
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            try:
+                user, _ = TokenAuthentication().authenticate(request) or (
+                    None, None
+                )
+            except AuthenticationFailed:
+                return None
+        return header if user is not None and user.is_staff else None
+
+    def trim(self):
+        names = sorted(os.listdir(settings.PROFILER_DIR))
+        for name in names[:-PROFILE_RING_SIZE]:
+            try:
+                os.remove(os.path.join(settings.PROFILER_DIR, name))
+            except FileNotFoundError:
+                pass
@@ -1,25 +1,47 @@
 import random
 import string
 
-from django.db.models import F
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Manager, OuterRef, Subquery
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
 from api.const import USERNAME_MAX_LENGTH
-from api.fields import Base64ImageField
+from api import pantry
+from api.feed import fan_out
+from api.fields import Base64ImageField, ReferenceRelatedField
+from api.membership import FAVORITES, SHOPPING_CART, memberships
+from api.metrics import CACHE_REQUESTS
+from api.mixins import SparseFieldsSerializerMixin
+from jobs.models import Job
+from jobs.queue import result_expired
+from recipes.documents import (
+    document_data,
+    rebuild as rebuild_documents,
+    store as store_document,
+)
 from recipes.models import (
     ArrayIngredient,
     Favorite,
     Ingredient,
     Recipe,
+    RecipeDocument,
     ShoppingCart,
     ShortLinkRecipe,
     Tag,
 )
+from recipes.reference import reference
 from users.models import Subscription, User
 
+# Поля рецепта, которые берутся из RecipeDocument.
+DOCUMENT_FIELDS = frozenset((
+    'tags', 'author', 'ingredients', 'name', 'image', 'text', 'cooking_time'
+))
+
 
 class TagSerializer(serializers.ModelSerializer):
 
@@ -48,7 +70,16 @@ class CreateUsersSerializer(UserCreateSerializer):
         )
 
 
-class UsersSerializer(UserSerializer):
+class UserListSerializer(serializers.ListSerializer):
+    """Список пользователей: подписки загружаются на всю страницу."""
+
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, Manager) else data)
+        self.child.preload(users)
+        return [self.child.to_representation(user) for user in users]
+
+
+class UsersSerializer(SparseFieldsSerializerMixin, UserSerializer):
     id = serializers.IntegerField()
     email = serializers.EmailField()
     is_subscribed = serializers.SerializerMethodField()
@@ -68,11 +99,24 @@ class UsersSerializer(UserSerializer):
             'is_subscribed',
             'avatar'
         )
+        list_serializer_class = UserListSerializer
+
+    def preload(self, users):
+        user = self.context.get('request').user
+        self.subscribed = set()
+        if user.is_authenticated and 'is_subscribed' in self.fields:
+            self.subscribed = set(
+                Subscription.objects.filter(
+                    user=user, following_id__in=[obj.id for obj in users]
+                ).values_list('following_id', flat=True)
+            )
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(self, 'subscribed'):
+            return obj.id in self.subscribed
         return Subscription.objects.filter(
             user=user,
             following=obj.id
@@ -106,7 +150,24 @@ class ChangePasswordSerializer(serializers.ModelSerializer):
         return value
 
 
-class ReadRecipeSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов: документы и флаги загружаются на всю страницу."""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        self.child.preload(recipes)
+        return [self.child.to_representation(recipe) for recipe in recipes]
+
+
+class ReadRecipeSerializer(
+    SparseFieldsSerializerMixin,
+    serializers.ModelSerializer
+):
+    """Рецепт для чтения.
+
+    Не зависящая от пользователя часть берется из RecipeDocument,
+    поверх нее накладываются флаги текущего пользователя.
+    """
     tags = TagSerializer(read_only=True, many=True)
     author = UsersSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField(read_only=True)
@@ -119,6 +180,7 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
+        list_serializer_class = RecipeListSerializer
         fields = (
             'id',
             'tags',
@@ -132,34 +194,100 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
-    def get_ingredients(self, obj):
-        """Cписок ингредиентов для рецепта."""
-        return obj.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('array_ingredients__amount'),
-        )
-
-    def base_favorited_shopping_cart(self, obj):
+    def preload(self, recipes):
+        """Документы рецептов и флаги пользователя одним пакетом.
+
+        Загружается только то, что нужно запрошенным полям.
+        """
+        fields = set(self.fields)
+        ids = [recipe.id for recipe in recipes]
+        self.loaded = set(ids)
+        self.documents = {}
+        if fields & DOCUMENT_FIELDS:
+            self.documents = {
+                recipe_id: document.data for recipe_id, document in
+                RecipeDocument.objects.in_bulk(ids).items()
+            }
+            missing = set(ids) - set(self.documents)
+            CACHE_REQUESTS.labels('recipe_document', 'hit').inc(
+                len(self.documents)
+            )
+            if missing:
+                CACHE_REQUESTS.labels('recipe_document', 'miss').inc(
+                    len(missing)
+                )
+                self.documents.update(
+                    (recipe_id, document.data) for recipe_id, document in
+                    rebuild_documents(missing).items()
+                )
+        self.favorited = self.in_shopping_cart = self.subscribed = set()
         user = self.context.get('request').user
         if user.is_anonymous:
-            return False
-        return obj.filter(
-            user=user
-        ).exists()
+            return
+        if fields & {'is_favorited', 'is_in_shopping_cart'}:
+            lists = memberships(user)
+            self.favorited = lists[FAVORITES]
+            self.in_shopping_cart = lists[SHOPPING_CART]
+        if 'author' in fields:
+            self.subscribed = set(
+                Subscription.objects.filter(
+                    user=user,
+                    following_id__in={recipe.author_id for recipe in recipes}
+                ).values_list('following_id', flat=True)
+            )
 
-    def get_is_favorited(self, obj):
-        """Избранное."""
-        return self.base_favorited_shopping_cart(obj.favorites)
+    def media_url(self, name):
+        if not name:
+            return None
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_author(self, author):
+        return {
+            'email': author['email'],
+            'id': author['id'],
+            'username': author['username'],
+            'first_name': author['first_name'],
+            'last_name': author['last_name'],
+            'is_subscribed': author['id'] in self.subscribed,
+            'avatar': self.media_url(author['avatar']),
+        }
+
+    def preset(self, instance, document, favorited=False,
+               in_shopping_cart=False, subscribed=False):
+        """Данные для рецепта, которые уже есть в памяти после записи."""
+        self.loaded = {instance.id}
+        self.documents = {instance.id: document}
+        self.favorited = {instance.id} if favorited else set()
+        self.in_shopping_cart = {instance.id} if in_shopping_cart else set()
+        self.subscribed = {instance.author_id} if subscribed else set()
+        return self
 
-    def get_is_in_shopping_cart(self, obj):
-        """Список покупок."""
-        return self.base_favorited_shopping_cart(obj.shopping_list)
+    def to_representation(self, instance):
+        if instance.id not in getattr(self, 'loaded', ()):
+            self.preload([instance])
+        document = self.documents.get(instance.id)
+        values = {
+            'id': lambda: instance.id,
+            'tags': lambda: document['tags'],
+            'author': lambda: self.get_author(document['author']),
+            'ingredients': lambda: document['ingredients'],
+            'is_favorited': lambda: instance.id in self.favorited,
+            'is_in_shopping_cart': lambda: (
+                instance.id in self.in_shopping_cart
+            ),
+            'name': lambda: document['name'],
+            'image': lambda: self.media_url(document['image']),
+            'text': lambda: document['text'],
+            'cooking_time': lambda: document['cooking_time'],
+        }
+        return {name: values[name]() for name in self.fields}
 
 
 class CreateArrayIngredients(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    id = ReferenceRelatedField(
+        lookup=reference.ingredient,
         queryset=Ingredient.objects.all()
     )
     amount = serializers.IntegerField(min_value=1)
@@ -175,7 +303,8 @@ class UpdateCreateRecipeSerializers(serializers.ModelSerializer):
         write_only=True,
         label='Ингредиенты',
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = ReferenceRelatedField(
+        lookup=reference.tag,
         many=True,
         queryset=Tag.objects.all(),
         label='Теги',
@@ -194,25 +323,19 @@ class UpdateCreateRecipeSerializers(serializers.ModelSerializer):
         )
 
     def validate_tags(self, data):
-        tags = []
-        for tag in data:
-            if tag in tags:
-                raise ValidationError(
-                    'Теги не должны повторяться.',
-                    Response(status=status.HTTP_400_BAD_REQUEST)
-                )
-            tags.append(tag)
+        if len({tag.id for tag in data}) != len(data):
+            raise ValidationError(
+                'Теги не должны повторяться.',
+                Response(status=status.HTTP_400_BAD_REQUEST)
+            )
         return data
 
     def validate_ingredients(self, data):
-        ingredients = []
-        for ingredient in data:
-            if ingredient in ingredients:
-                raise ValidationError(
-                    'Ингредиент не должны повторяться.',
-                    Response(status=status.HTTP_400_BAD_REQUEST)
-                )
-            ingredients.append(ingredient)
+        if len({ingredient['id'].id for ingredient in data}) != len(data):
+            raise ValidationError(
+                'Ингредиент не должны повторяться.',
+                Response(status=status.HTTP_400_BAD_REQUEST)
+            )
         return data
 
     def create_ingredients(self, ingredients, recipes):
@@ -227,14 +350,42 @@ class UpdateCreateRecipeSerializers(serializers.ModelSerializer):
             )
         ArrayIngredient.objects.bulk_create(ingredient_recipes)
 
+    def update_pantry_index(self, ingredients, recipes):
+        ingredient_ids = [ingredient['id'].id for ingredient in ingredients]
+        transaction.on_commit(
+            lambda: pantry.index.update(recipes.id, ingredient_ids)
+        )
+
+    def store_document(self, recipes, tags, ingredients, created=False):
+        """Документ рецепта из уже проверенных данных, без перечитывания."""
+        self.document = document_data(
+            recipes,
+            recipes.author,
+            tags,
+            ((ingredient['id'], ingredient['amount'])
+             for ingredient in ingredients),
+        )
+        store_document(recipes.id, self.document, created=created)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipes = Recipe.objects.create(**validated_data)
         self.create_ingredients(ingredients, recipes)
-        recipes.tags.set(tags)
+        # У нового рецепта связей нет, сравнивать с текущими не нужно.
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipes.id, tag_id=tag.id)
+            for tag in tags
+        )
+        transaction.on_commit(lambda: fan_out(recipes))
+        self.update_pantry_index(ingredients, recipes)
+        self.store_document(recipes, tags, ingredients, created=True)
+        # У нового рецепта флаги заведомо ложные.
+        self.flags = {}
         return recipes
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
@@ -243,12 +394,32 @@ class UpdateCreateRecipeSerializers(serializers.ModelSerializer):
         instance.ingredients.clear()
         instance.tags.set(tags)
         self.create_ingredients(ingredients=ingredients, recipes=instance)
+        self.update_pantry_index(ingredients, instance)
+        self.store_document(instance, tags, ingredients)
+        self.flags = self.get_flags(instance)
         return instance
 
+    def get_flags(self, instance):
+        """Флаги пользователя для измененного рецепта."""
+        user = self.context.get('request').user
+        lists = memberships(user)
+        return {
+            'favorited': instance.id in lists[FAVORITES],
+            'in_shopping_cart': instance.id in lists[SHOPPING_CART],
+            # На себя автор подписаться не может.
+            'subscribed': instance.author_id != user.id and (
+                Subscription.objects.filter(
+                    user=user, following_id=instance.author_id
+                ).exists()
+            ),
+        }
+
     def to_representation(self, instance):
-        request = self.context.get('request')
-        context = {'request': request}
-        return ReadRecipeSerializer(instance, context=context).data
+        """Ответ собирается из записанных данных без перечитывания."""
+        serializer = ReadRecipeSerializer(instance, context=self.context)
+        if getattr(self, 'document', None) is None:
+            return serializer.data
+        return serializer.preset(instance, self.document, **self.flags).data
 
 
 class ShortLinkSerializer(serializers.ModelSerializer):
@@ -276,7 +447,8 @@ class ShortLinkSerializer(serializers.ModelSerializer):
             )
 
 
-class ForFavoritesandShoppingCartSerializer(ReadRecipeSerializer):
+class ForFavoritesandShoppingCartSerializer(serializers.ModelSerializer):
+    image = Base64ImageField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -287,33 +459,26 @@ class FavoritesandShoppingCartSerializer(serializers.ModelSerializer):
     recipes = ForFavoritesandShoppingCartSerializer(read_only=True)
 
     def to_internal_value(self, data):
-        user = data.get('user')
-        recipes = data.get('recipes')
+        return {
+            'user': data.get('user'),
+            'recipes': data.get('recipes')
+        }
+
+    def create(self, validated_data):
+        # Повтор ловится уникальным ограничением, без отдельной проверки.
         try:
-            self.Meta.model.objects.get(
-                recipes=recipes,
-                user=user
-            )
-        except self.Meta.model.DoesNotExist:
-            return {
-                'user': user,
-                'recipes': recipes
-            }
-        if recipes:
+            with transaction.atomic():
+                return self.Meta.model.objects.create(
+                    user=validated_data.get('user'),
+                    recipes=validated_data.get('recipes')
+                )
+        except IntegrityError:
             raise ValidationError(
                 {
                     'Ошибка': 'Данный рецепт уже в списке'
                 }
             )
 
-    def create(self, validated_data):
-        user = validated_data.get('user')
-        recipes = validated_data.get('recipes')
-        return self.Meta.model.objects.create(
-            user=user,
-            recipes=recipes
-        )
-
 
 class FavoritesSerializer(FavoritesandShoppingCartSerializer):
 
@@ -329,7 +494,24 @@ class ShoppingCartSerializer(FavoritesandShoppingCartSerializer):
         fields = ('recipes',)
 
 
-class SubscriptionsUserSerializer(serializers.ModelSerializer):
+class SubscriptionListSerializer(serializers.ListSerializer):
+    """Страница подписок: рецепты и их число на всю страницу сразу."""
+
+    def to_representation(self, data):
+        subscriptions = list(
+            data.all() if isinstance(data, Manager) else data
+        )
+        self.child.preload(subscriptions)
+        return [
+            self.child.to_representation(subscription)
+            for subscription in subscriptions
+        ]
+
+
+class SubscriptionsUserSerializer(
+    SparseFieldsSerializerMixin,
+    serializers.ModelSerializer
+):
     id = serializers.ReadOnlyField(source='following.id')
     email = serializers.ReadOnlyField(source='following.email')
     username = serializers.ReadOnlyField(source='following.username')
@@ -352,23 +534,102 @@ class SubscriptionsUserSerializer(serializers.ModelSerializer):
             'recipes',
             'recipes_count'
         )
+        list_serializer_class = SubscriptionListSerializer
+
+    def get_recipes_limit(self):
+        limit = self.context.get('request').GET.get('recipes_limit')
+        return int(limit) if limit else None
+
+    def preload(self, subscriptions):
+        """Первые recipes_limit рецептов каждого автора одним запросом."""
+        author_ids = [obj.following_id for obj in subscriptions]
+        limit = self.get_recipes_limit()
+        self.author_recipes = {author_id: [] for author_id in author_ids}
+        if 'recipes' not in self.fields and (
+            'recipes_count' not in self.fields
+        ):
+            return
+        queryset = Recipe.objects.filter(author_id__in=author_ids)
+        if limit:
+            queryset = queryset.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author_id=OuterRef('author_id')
+                ).order_by('id').values('id')[:limit]
+            ))
+        for recipe in queryset.order_by('id'):
+            self.author_recipes[recipe.author_id].append(recipe)
+        full = [
+            author_id for author_id, recipes in self.author_recipes.items()
+            if limit and len(recipes) == limit
+        ]
+        self.recipes_counts = {
+            author_id: len(recipes)
+            for author_id, recipes in self.author_recipes.items()
+        }
+        if full and 'recipes_count' in self.fields:
+            self.recipes_counts.update(
+                Recipe.objects.filter(author_id__in=full).values(
+                    'author_id'
+                ).annotate(count=Count('id')).values_list(
+                    'author_id', 'count'
+                )
+            )
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        # Своя подписка видна без запроса к базе.
+        if obj.user_id == user.id:
+            return True
         return Subscription.objects.filter(
             user=user,
             following=obj.following
         ).exists()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        queryset = Recipe.objects.filter(author=obj.following)
-        if limit:
-            queryset = queryset[:int(limit)]
-        return ForFavoritesandShoppingCartSerializer(queryset, many=True).data
+        if hasattr(self, 'author_recipes'):
+            recipes = self.author_recipes[obj.following_id]
+        else:
+            limit = self.get_recipes_limit()
+            queryset = Recipe.objects.filter(author=obj.following)
+            if limit:
+                queryset = queryset[:limit]
+            recipes = list(queryset)
+            # Если рецептов меньше лимита, их число известно без COUNT.
+            if not limit or len(recipes) < limit:
+                obj.recipes_count = len(recipes)
+        return ForFavoritesandShoppingCartSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
+        if hasattr(self, 'recipes_counts'):
+            return self.recipes_counts[obj.following_id]
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return Recipe.objects.filter(author=obj.following).count()
+
+
+class JobSerializer(serializers.ModelSerializer):
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = (
+            'id',
+            'kind',
+            'status',
+            'result',
+            'created_at',
+            'finished_at',
+        )
+        read_only_fields = fields
+
+    def get_result(self, obj):
+        """Ссылка на выгрузку, которую отдают только владельцу задачи."""
+        if not obj.result or result_expired(obj):
+            return None
+        return reverse(
+            'api:job-download',
+            args=(obj.pk,),
+            request=self.context.get('request'),
+        )
@@ -0,0 +1,139 @@
+"""Журнал медленных запросов к базе.
+
+Запросы дольше SLOW_QUERY_THRESHOLD миллисекунд записываются в
+SLOW_QUERY_LOG строкой JSON: SQL, типы параметров, вьюха и место вызова
+в коде проекта. Значения параметров (токены, почта, хеши паролей) не
+пишутся, файл доступен только владельцу. Для доли
+SLOW_QUERY_EXPLAIN_RATE медленных SELECT снимается план без выполнения
+запроса: EXPLAIN в PostgreSQL, EXPLAIN QUERY PLAN в SQLite. Журнал
+ограничен: при превышении
+SLOW_QUERY_LOG_MAX_BYTES текущий файл становится <файл>.1, прежний .1
+удаляется. Сводку строит команда slow_queries.
+"""
+import json
+import os
+import random
+import time
+import traceback
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from api.const import SLOW_QUERY_LOG_MAX_BYTES
+from api.metrics import view_name
+
+PROJECT_DIR = str(settings.BASE_DIR)
+# Middleware, через которые проходит любой запрос, не считаются местом
+# вызова.
+SKIPPED_FILES = {
+    __file__,
+    os.path.join(PROJECT_DIR, 'api', 'metrics.py'),
+    os.path.join(PROJECT_DIR, 'api', 'profiling.py'),
+}
+
+
+def call_site():
+    """Ближайший к запросу кадр из кода проекта."""
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(PROJECT_DIR) and (
+            frame.filename not in SKIPPED_FILES
+            and 'site-packages' not in frame.filename
+        ):
+            path = os.path.relpath(frame.filename, PROJECT_DIR)
+            return f'{path}:{frame.lineno} in {frame.name}'
+    return None
+
+
+def param_types(params):
+    if isinstance(params, dict):
+        params = params.values()
+    return [type(param).__name__ for param in (params or ())]
+
+
+def log_paths():
+    """Файлы журнала от старого к новому."""
+    return (f'{settings.SLOW_QUERY_LOG}.1', settings.SLOW_QUERY_LOG)
+
+
+def write_entry(entry):
+    path = settings.SLOW_QUERY_LOG
+    try:
+        if os.path.getsize(path) > SLOW_QUERY_LOG_MAX_BYTES:
+            os.replace(path, f'{path}.1')
+    except FileNotFoundError:
+        pass
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    with open(descriptor, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+
+
+class SlowQueryRecorder:
+
+    def __init__(self, view=None):
+        self.view = view
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = (time.perf_counter() - start) * 1000
+        if duration >= settings.SLOW_QUERY_THRESHOLD:
+            entry = {
+                'at': timezone.now().isoformat(),
+                'duration_ms': round(duration, 3),
+                'sql': sql,
+                'param_types': None if many else param_types(params),
+                'view': self.view,
+                'call_site': call_site(),
+            }
+            if not many and sql.lstrip()[:6].upper() == 'SELECT' and (
+                random.random() < settings.SLOW_QUERY_EXPLAIN_RATE
+            ):
+                entry['plan'] = self.explain(
+                    context['connection'], sql, params
+                )
+            write_entry(entry)
+        return result
+
+    def explain(self, db, sql, params):
+        if db.vendor == 'postgresql':
+            prefix = 'EXPLAIN '
+        elif db.vendor == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            return None
+        self.explaining = True
+        try:
+            # Точка сохранения, чтобы ошибка EXPLAIN не сломала транзакцию.
+            with transaction.atomic(using=db.alias):
+                with db.cursor() as cursor:
+                    cursor.execute(prefix + sql, params)
+                    return '\n'.join(
+                        ' '.join(map(str, row)) for row in cursor.fetchall()
+                    )
+        except DatabaseError as error:
+            return f'EXPLAIN failed: {error}'
+        finally:
+            self.explaining = False
+
+
+class SlowQueryMiddleware:
+
+    def __init__(self, get_response):
+        if settings.SLOW_QUERY_THRESHOLD is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.slow_query_recorder = SlowQueryRecorder()
+        with connection.execute_wrapper(request.slow_query_recorder):
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.slow_query_recorder.view = view_name(
+            view_func, request.method
+        )
@@ -0,0 +1,98 @@
+"""Хранилище медиафайлов с адресацией по содержимому.
+
+Файлы из каталогов CONTENT_ADDRESSED_DIRS сохраняются под именем
+<каталог>/<ab>/<cd>/<sha256><расширение>, поэтому одинаковые загрузки
+занимают один файл. Ссылками на файл считаются значения файловых полей
+моделей: когда значение меняется или запись удаляется, файл без других
+ссылок удаляется (release). Файлы моложе MEDIA_GC_GRACE release не
+трогает: такой файл мог только что загрузить другой запрос, ссылка на
+него еще не сохранена. Их и остальные потерянные файлы собирает команда
+gc_media, поэтому ее нужно запускать по расписанию, например раз в час
+из cron.
+"""
+import hashlib
+import os
+import time
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import models
+
+from api.const import MEDIA_GC_GRACE
+
+CONTENT_ADDRESSED_DIRS = ('recipes/image', 'users/avatar')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        if os.path.dirname(name) in CONTENT_ADDRESSED_DIRS:
+            # Окончательное имя зависит от содержимого и выбирается в _save.
+            return name
+        return super().get_available_name(name, max_length)
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return '/'.join((
+            os.path.dirname(name), digest[:2], digest[2:4], digest + extension
+        ))
+
+    def _save(self, name, content):
+        if os.path.dirname(name) not in CONTENT_ADDRESSED_DIRS:
+            return super()._save(name, content)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Свежая отметка времени защищает файл от gc_media, пока
+            # новая ссылка на него не сохранена в базе.
+            os.utime(self.path(name))
+            return name
+        return super()._save(name, content)
+
+
+def file_fields():
+    """Файловые поля моделей, значения которых ссылаются на файлы."""
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField) and (
+                field.storage is default_storage
+            ):
+                yield model, field.name
+
+
+def referenced(names):
+    """Имена из names, на которые ссылается хотя бы одна запись."""
+    names = set(names)
+    found = set()
+    for model, field in file_fields():
+        if names - found:
+            found.update(
+                model.objects.filter(
+                    **{f'{field}__in': names - found}
+                ).values_list(field, flat=True)
+            )
+    return found
+
+
+def is_stale(name, storage=default_storage):
+    return time.time() - os.path.getmtime(storage.path(name)) > MEDIA_GC_GRACE
+
+
+def release(name, storage=default_storage):
+    """Удаляет файл, если на него больше нет ссылок.
+
+    Свежие файлы пропускаются и остаются для gc_media.
+    """
+    if not name or os.path.dirname(
+        os.path.dirname(os.path.dirname(name))
+    ) not in CONTENT_ADDRESSED_DIRS:
+        return
+    try:
+        if not is_stale(name, storage) or referenced((name,)):
+            return
+    except FileNotFoundError:
+        return
+    storage.delete(name)
@@ -0,0 +1,166 @@
+"""Синхронизация клиентов по журналу изменений.
+
+Клиент загружает данные обычными списками, запоминает токен из
+/api/sync/ и дальше запрашивает только изменения после него: рецепты
+пользователя, избранное, корзину и подписки. Удаления приходят
+идентификаторами в deleted. Для клиента без изменений ответ строится
+одним запросом по индексу (user, id).
+
+Токен - id записи журнала, поэтому записи одного пользователя должны
+фиксироваться в порядке id: иначе клиент получит больший токен, пока
+запись с меньшим id еще не видна, и пропустит ее. Изменения транзакции
+копятся (record_change) и после ее фиксации пишутся одним INSERT под
+рекомендательными блокировками их владельцев, взятыми за один запрос по
+возрастанию id (lock_users).
+
+Журнал старше CHANGE_LOG_RETENTION удаляет prune_changes из
+run_workers; клиент с удаленным токеном получает 400 и загружает данные
+заново.
+"""
+import threading
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from api.const import (
+    CHANGE_LOG_RETENTION,
+    SYNC_LOCK_NAMESPACE,
+    SYNC_PAGE_SIZE,
+)
+from recipes.models import ChangeLog
+
+# Изменения текущей транзакции: (список on_commit соединения, записи).
+_pending = threading.local()
+
+SECTIONS = {
+    ChangeLog.RECIPE: 'recipes',
+    ChangeLog.FAVORITE: 'favorites',
+    ChangeLog.SHOPPING_CART: 'shopping_cart',
+    ChangeLog.SUBSCRIPTION: 'subscriptions',
+}
+
+
+def lock_users(user_ids):
+    """Упорядочивает записи журнала пользователей user_ids.
+
+    Вызывается в транзакции до записи в журнал: следующая запись для
+    того же пользователя получит id только после фиксации этой.
+    Блокировки рекомендательные, строки пользователей не блокируются;
+    они берутся по возрастанию id, чтобы транзакции не ждали друг друга
+    по кругу. SQLite и так выполняет записи по одной.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(%s, (user_id %% 2147483647)::int) '
+            'FROM (SELECT DISTINCT unnest(%s::bigint[]) AS user_id '
+            'ORDER BY user_id) AS users',
+            (SYNC_LOCK_NAMESPACE, sorted(set(user_ids))),
+        )
+
+
+def write_changes(changes):
+    """Записывает изменения одной транзакцией."""
+    with transaction.atomic():
+        lock_users(change.user_id for change in changes)
+        ChangeLog.objects.bulk_create(changes)
+
+
+def record_change(change):
+    """Записывает изменение после фиксации текущей транзакции.
+
+    Все изменения транзакции (например, каскад удаления рецепта из
+    избранного многих пользователей) пишутся вместе.
+    """
+    if not connection.in_atomic_block:
+        write_changes([change])
+        return
+    # Список on_commit заменяется новым после фиксации или отката.
+    hooks = connection.run_on_commit
+    batch = getattr(_pending, 'batch', None)
+    if batch is None or batch[0] is not hooks:
+        batch = (hooks, [])
+        _pending.batch = batch
+        transaction.on_commit(lambda: flush(batch))
+    batch[1].append(change)
+
+
+def flush(batch):
+    if getattr(_pending, 'batch', None) is batch:
+        _pending.batch = None
+    write_changes(batch[1])
+
+
+def prune_changes():
+    """Удаляет записи журнала старше CHANGE_LOG_RETENTION."""
+    cutoff = timezone.now() - timedelta(seconds=CHANGE_LOG_RETENTION)
+    # Граница по id: записи после нее остаются все, поэтому токен,
+    # запись которого сохранилась, ничего не пропускает.
+    first_kept = ChangeLog.objects.filter(
+        created_at__gte=cutoff
+    ).order_by('id').values_list('id', flat=True).first()
+    stale = ChangeLog.objects.all()
+    if first_kept is not None:
+        stale = stale.filter(id__lt=first_kept)
+    deleted, _ = stale.delete()
+    return deleted
+
+
+def empty_sections():
+    return {
+        section: {'changed': [], 'deleted': []}
+        for section in SECTIONS.values()
+    }
+
+
+def parse_token(value):
+    try:
+        token = int(value)
+    except (TypeError, ValueError):
+        token = -1
+    if token < 0:
+        raise ValidationError({'since': 'Некорректный токен синхронизации.'})
+    return token
+
+
+def latest_token(user):
+    return ChangeLog.objects.filter(user=user).order_by(
+        '-id'
+    ).values_list('id', flat=True).first() or 0
+
+
+def changes_since(user, since, limit=SYNC_PAGE_SIZE):
+    """Последнее состояние каждого измененного объекта после since.
+
+    Возвращает новый токен, признак следующей страницы и разделы
+    {'recipes': {'changed': [id], 'deleted': [id]}, ...}. Токен - id
+    записи пользователя; если ее уже удалил prune_changes, изменения
+    могли потеряться.
+    """
+    rows = list(
+        ChangeLog.objects.filter(user=user, id__gte=since).order_by(
+            'id'
+        ).values_list('id', 'kind', 'object_id', 'deleted')[:limit + 2]
+    )
+    if since:
+        if not rows or rows[0][0] != since:
+            raise ValidationError(
+                {'since': 'Токен устарел, загрузите данные заново.'}
+            )
+        rows = rows[1:]
+    rows = rows[:limit + 1]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {}
+    for _, kind, object_id, deleted in rows:
+        latest.pop((kind, object_id), None)
+        latest[(kind, object_id)] = deleted
+    sections = empty_sections()
+    for (kind, object_id), deleted in latest.items():
+        sections[SECTIONS[kind]][
+            'deleted' if deleted else 'changed'
+        ].append(object_id)
+    return (rows[-1][0] if rows else since), has_more, sections
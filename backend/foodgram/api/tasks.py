@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+
+from django.core.files.base import ContentFile
+from django.db.models import Sum
+
+from api.feed import FEED_FAN_OUT, write_timeline
+from jobs.queue import task
+from recipes.models import ArrayIngredient, Favorite, Recipe, ShoppingCart
+from users.models import Subscription
+
+SHOPPING_CART_EXPORT = 'shopping_cart_export'
+USER_DATA_EXPORT = 'user_data_export'
+
+
+def shopping_cart_ingredients(user):
+    """Суммарное количество ингредиентов из списка покупок."""
+    return ArrayIngredient.objects.filter(
+        recipes__shopping_list__user=user
+    ).values(
+        'ingredients__name',
+        'ingredients__measurement_unit'
+    ).annotate(
+        quantity=Sum('amount')
+    )
+
+
+def write_shopping_cart_csv(stream, ingredients):
+    writer = csv.writer(stream)
+    for product in ingredients.iterator():
+        writer.writerow(
+            [
+                product.get('ingredients__name'),
+                product.get('quantity'),
+                product.get('ingredients__measurement_unit'),
+            ]
+        )
+
+
+@task(SHOPPING_CART_EXPORT)
+def export_shopping_cart(job):
+    """Выгрузка списка покупок в csv."""
+    stream = io.StringIO()
+    write_shopping_cart_csv(stream, shopping_cart_ingredients(job.user))
+    return ContentFile(
+        stream.getvalue().encode(),
+        name='product_list.csv'
+    )
+
+
+@task(USER_DATA_EXPORT)
+def export_user_data(job):
+    """Выгрузка всех данных пользователя в json."""
+    user = job.user
+    data = {
+        'user': {
+            'email': user.email,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+        },
+        'recipes': [
+            {
+                'id': recipe.id,
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'image': recipe.image.name or None,
+                'tags': [tag.slug for tag in recipe.tags.all()],
+                'ingredients': [
+                    {
+                        'name': item.ingredients.name,
+                        'measurement_unit': item.ingredients.measurement_unit,
+                        'amount': item.amount,
+                    }
+                    for item in recipe.array_ingredients.all()
+                ],
+            }
+            for recipe in Recipe.objects.filter(author=user).prefetch_related(
+                'tags',
+                'array_ingredients__ingredients',
+            )
+        ],
+        'favorites': list(
+            Favorite.objects.filter(user=user).values_list(
+                'recipes_id', flat=True
+            )
+        ),
+        'shopping_cart': list(
+            ShoppingCart.objects.filter(user=user).values_list(
+                'recipes_id', flat=True
+            )
+        ),
+        'subscriptions': list(
+            Subscription.objects.filter(user=user).values_list(
+                'following__username', flat=True
+            )
+        ),
+    }
+    return ContentFile(
+        json.dumps(data, ensure_ascii=False, indent=2).encode(),
+        name='user_data.json'
+    )
+
+
+@task(FEED_FAN_OUT)
+def feed_fan_out(job):
+    """Раскладка рецепта по лентам подписчиков."""
+    recipe = Recipe.objects.filter(pk=job.payload.get('recipe')).first()
+    if recipe is not None:
+        write_timeline(recipe)
@@ -0,0 +1,595 @@
+import itertools
+import re
+import tempfile
+import time
+from collections import Counter, namedtuple
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.deadlines import DeadlineExceeded, deadline
+from api.filters import RecipesFilter
+from api.membership import membership_query
+from api.pantry import PantryIndex
+from jobs.models import Job
+from recipes.documents import rebuild
+from recipes.models import (
+    ArrayIngredient,
+    Favorite,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+    SimilarRecipe,
+    Tag,
+    TimelineEntry,
+)
+from users.models import Subscription, User
+
+# Бюджет маршрута: перечисленные запросы к базе при прогретом кеше и
+# QUERY_HEADROOM сверху (PostgreSQL добавляет блокировку журнала
+# изменений, кеш в памяти иногда перечитывает инвалидации). Число
+# запросов не растет вместе с размером данных, если flat.
+Budget = namedtuple(
+    'Budget', ('name', 'method', 'path', 'queries', 'flat'), defaults=(True,)
+)
+
+QUERY_HEADROOM = 1
+SIZES = (3, 12)
+# URLField короткой ссылки не принимает адрес без домена верхнего уровня.
+HOST = 'budget.example.com'
+TOKEN = 'токен и пользователь'
+SAVEPOINT = ('точка сохранения', 'освобождение точки сохранения')
+CHANGE_LOG = ('точка сохранения журнала', 'запись в журнал изменений',
+              'освобождение точки сохранения журнала')
+RECIPES = ('рецепты', 'документы рецептов', 'чтение инвалидаций кеша',
+           'подписки на авторов')
+INVALIDATION = ('чтение инвалидаций кеша', 'запись инвалидации')
+
+BUDGETS = (
+    Budget(
+        'tag-list', 'get', lambda s: reverse('api:tag-list'),
+        (TOKEN, 'версия справочников'),
+    ),
+    Budget(
+        'tag-detail', 'get',
+        lambda s: reverse('api:tag-detail', args=(s.tags[0].id,)),
+        (TOKEN, 'версия справочников'),
+    ),
+    Budget(
+        'ingredient-list', 'get',
+        lambda s: reverse('api:ingredient-list') + '?name=ing',
+        (TOKEN, 'версия справочников'),
+    ),
+    Budget(
+        'ingredient-detail', 'get',
+        lambda s: reverse(
+            'api:ingredient-detail', args=(s.ingredients[0].id,)
+        ),
+        (TOKEN, 'версия справочников'),
+    ),
+    Budget(
+        'user-list', 'get',
+        lambda s: reverse('api:user-list') + f'?limit={s.n}',
+        (TOKEN, 'число пользователей', 'страница', 'подписки на страницу'),
+    ),
+    Budget(
+        'user-detail', 'get',
+        lambda s: reverse('api:user-detail', args=(s.authors[0].id,)),
+        (TOKEN, 'пользователь', 'подписка на него'),
+    ),
+    Budget(
+        'user-user-me', 'get', lambda s: reverse('api:user-user-me'),
+        (TOKEN, 'подписка на себя'),
+    ),
+    Budget(
+        'user-subscriptions', 'get',
+        lambda s: reverse('api:user-subscriptions')
+        + f'?limit={s.n}&recipes_limit=2',
+        (TOKEN, 'число подписок', 'страница с авторами',
+         'рецепты авторов', 'число рецептов авторов'),
+    ),
+    Budget(
+        'user-subscribe', 'post',
+        lambda s: reverse('api:user-subscribe', args=(s.extra_author.id,)),
+        (TOKEN, 'автор', *SAVEPOINT, 'подписка', 'рецепты для ленты',
+         'запись в ленту', 'рецепты для ответа', *CHANGE_LOG),
+    ),
+    Budget(
+        'recipe-list', 'get',
+        lambda s: reverse('api:recipe-list') + f'?limit={s.n}',
+        (TOKEN, *RECIPES),
+    ),
+    Budget(
+        'recipe-list-favorited', 'get',
+        lambda s: reverse('api:recipe-list') + '?is_favorited=1',
+        (TOKEN, *RECIPES),
+    ),
+    Budget(
+        'recipe-detail', 'get',
+        lambda s: reverse('api:recipe-detail', args=(s.recipes[0].id,)),
+        (TOKEN, *RECIPES),
+    ),
+    Budget(
+        'recipe-batch', 'get',
+        lambda s: reverse('api:recipe-batch') + '?ids=' + ','.join(
+            str(recipe.id) for recipe in s.recipes
+        ),
+        (TOKEN, *RECIPES),
+    ),
+    Budget(
+        'recipe-feed', 'get',
+        lambda s: reverse('api:recipe-feed') + f'?limit={s.n}',
+        (TOKEN, 'лента', 'рецепты популярных авторов', *RECIPES),
+    ),
+    Budget(
+        'recipe-pantry', 'get',
+        lambda s: reverse('api:recipe-pantry') + '?ingredients=' + ','.join(
+            str(ingredient.id) for ingredient in s.ingredients[:3]
+        ),
+        (TOKEN, *RECIPES),
+    ),
+    Budget(
+        'recipe-similar', 'get',
+        lambda s: reverse('api:recipe-similar', args=(s.recipes[0].id,)),
+        (TOKEN, 'рецепт', 'похожие рецепты'),
+    ),
+    Budget(
+        'recipe-shortlink', 'get',
+        lambda s: reverse('api:recipe-shortlink', args=(s.recipes[0].id,)),
+        (TOKEN, 'рецепт', 'короткая ссылка', 'запись ссылки',
+         'сброс ссылки в общем кеше', *INVALIDATION),
+    ),
+    Budget(
+        'recipe-favorite', 'post',
+        lambda s: reverse('api:recipe-favorite', args=(s.extra_recipe.id,)),
+        (TOKEN, 'рецепт', *SAVEPOINT, 'избранное',
+         'сброс множеств в общем кеше', *INVALIDATION, *CHANGE_LOG),
+    ),
+    Budget(
+        'recipe-download-shopping-cart', 'get',
+        lambda s: reverse('api:recipe-download-shopping-cart'),
+        (TOKEN, 'число рецептов в корзине', 'сумма ингредиентов'),
+    ),
+    Budget(
+        'job-list', 'get',
+        lambda s: reverse('api:job-list') + f'?limit={s.n}',
+        (TOKEN, 'число задач', 'страница'),
+    ),
+    Budget(
+        'job-detail', 'get',
+        lambda s: reverse('api:job-detail', args=(s.jobs[0].id,)),
+        (TOKEN, 'задача'),
+    ),
+    Budget(
+        'sync', 'get',
+        lambda s: reverse('api:sync') + f'?since={s.token}',
+        (TOKEN, 'журнал изменений', *RECIPES),
+    ),
+)
+
+# Маршруты без бюджета: запись, djoser и служебные.
+UNBUDGETED = {
+    'api-root', 'profile', 'login', 'logout', 'user-me',
+    'user-change-avatar', 'user-change-password', 'user-export-data',
+    'user-activation', 'user-resend-activation', 'user-reset-password',
+    'user-reset-password-confirm', 'user-reset-username',
+    'user-reset-username-confirm', 'user-set-password', 'user-set-username',
+    'recipe-is-in-shopping-cart', 'job-download',
+}
+
+IN_LIST = re.compile(r'IN \((?:%s|\d+)(?:, (?:%s|\d+))*\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+
+def normalize(sql):
+    """SQL без конкретных значений, чтобы одинаковые запросы совпадали."""
+    return NUMBER.sub('N', IN_LIST.sub('IN (...)', sql))
+
+
+def report(queries):
+    """Запросы ответа; повторяющиеся - с числом повторов."""
+    repeated = Counter(normalize(query['sql']) for query in queries)
+    return '\n'.join(
+        f'  {count} x {sql}' if count > 1 else f'  {sql}'
+        for sql, count in repeated.most_common()
+    )
+
+
+def seed(n):
+    """Данные, размер которых растет вместе с n."""
+    # Без хеширования паролей: входят по токену.
+    viewer = User.objects.create(
+        username='budget_viewer', email='budget_viewer@example.com',
+    )
+    authors = [
+        User.objects.create(
+            username=f'budget_author_{i}',
+            email=f'budget_author_{i}@example.com',
+        )
+        for i in range(n + 1)
+    ]
+    tags = [
+        Tag.objects.create(name=f'budget {i}', slug=f'budget_{i}')
+        for i in range(n)
+    ]
+    ingredients = [
+        Ingredient.objects.create(name=f'ing {i}', measurement_unit='г')
+        for i in range(3 * n)
+    ]
+    recipes = []
+    for i, author in enumerate([viewer] * n + authors * 2):
+        recipe = Recipe.objects.create(
+            author=author, name=f'budget {i}', text='budget',
+            cooking_time=10,
+        )
+        recipe.tags.set(tags[i % n:i % n + 2])
+        ArrayIngredient.objects.bulk_create(
+            ArrayIngredient(recipes=recipe, ingredients=ingredient, amount=1)
+            for ingredient in ingredients[i % n:i % n + 3]
+        )
+        recipes.append(recipe)
+    rebuild(recipe.id for recipe in recipes)
+    extra_author = authors.pop()
+    extra_recipe = recipes.pop()
+    for author in authors:
+        Subscription.objects.create(user=viewer, following=author)
+    for recipe in recipes[:n]:
+        Favorite.objects.create(user=viewer, recipes=recipe)
+        ShoppingCart.objects.create(user=viewer, recipes=recipe)
+    TimelineEntry.objects.bulk_create(
+        TimelineEntry(user=viewer, recipe=recipe) for recipe in recipes[n:]
+    )
+    SimilarRecipe.objects.bulk_create(
+        SimilarRecipe(recipe=recipes[0], similar=recipe, score=0.5)
+        for recipe in recipes[1:n + 1]
+    )
+    jobs = [
+        Job.objects.create(
+            kind='budget', user=viewer, dedup_key=f'budget:{i}'
+        )
+        for i in range(n)
+    ]
+    return SimpleNamespace(
+        n=n, viewer=viewer, authors=authors, tags=tags,
+        ingredients=ingredients, recipes=recipes[:n], jobs=jobs,
+        extra_author=extra_author, extra_recipe=extra_recipe,
+    )
+
+
+@override_settings(
+    ALLOWED_HOSTS=[HOST],
+    REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}},
+)
+class QueryBudgetTests(TestCase):
+    """Число запросов к базе для маршрутов API.
+
+    Каждый маршрут проверяется на засеянных данных размеров SIZES, засев
+    откатывается. Хуки on_commit выполняются, как в автокоммите: запись
+    журнала изменений и сброс кеша входят в замер.
+    """
+
+    def measure(self, budget, size, cold=False):
+        """Запросы ответа; без cold после прогревающего запроса."""
+        with transaction.atomic():
+            with self.captureOnCommitCallbacks(execute=True):
+                data = seed(size)
+            # Токен синхронизации - последняя запись журнала до засева.
+            data.token = data.viewer.changes.order_by(
+                'id'
+            ).values_list('id', flat=True).first()
+            client = APIClient(HTTP_HOST=HOST)
+            client.credentials(
+                HTTP_AUTHORIZATION='Token '
+                + Token.objects.create(user=data.viewer).key
+            )
+            path = budget.path(data)
+            # id в SQLite после отката выдаются заново, кеш прошлого
+            # засева не должен попасть в замер.
+            cache.clear()
+            if not cold:
+                with transaction.atomic():
+                    with self.captureOnCommitCallbacks(execute=True):
+                        getattr(client, budget.method)(path)
+                    transaction.set_rollback(True)
+            with transaction.atomic():
+                if cold:
+                    cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    with self.captureOnCommitCallbacks(execute=True):
+                        response = getattr(client, budget.method)(path)
+                transaction.set_rollback(True)
+            transaction.set_rollback(True)
+        self.assertLess(
+            response.status_code, 400, f'{path}: {response.status_code}'
+        )
+        return queries.captured_queries
+
+    def check_growth(self, budget, cold):
+        runs = [self.measure(budget, size, cold) for size in SIZES]
+        counts = [len(queries) for queries in runs]
+        if budget.flat:
+            self.assertLessEqual(
+                counts[-1], counts[0],
+                'число запросов растет с данными: ' + ' -> '.join(
+                    f'{count} (n={size})'
+                    for size, count in zip(SIZES, counts)
+                ) + '\n' + report(runs[-1]),
+            )
+        return runs[-1]
+
+    def test_budgets(self):
+        for budget in BUDGETS:
+            with self.subTest(budget.name):
+                queries = self.check_growth(budget, cold=False)
+                limit = len(budget.queries) + QUERY_HEADROOM
+                self.assertLessEqual(
+                    len(queries), limit,
+                    f'{len(queries)} запросов, бюджет {limit}: '
+                    + ', '.join(budget.queries) + '\n' + report(queries),
+                )
+
+    def test_cold_cache_does_not_grow(self):
+        for budget in BUDGETS:
+            with self.subTest(budget.name):
+                self.check_growth(budget, cold=True)
+
+    def test_routes_have_budgets(self):
+        budgeted = {budget.name for budget in BUDGETS}
+        self.assertEqual(
+            sorted(
+                name for name in get_resolver('api.urls').reverse_dict
+                if isinstance(name, str)
+                and name not in budgeted | UNBUDGETED
+            ),
+            [],
+        )
+
+
+class RecipeFilterPlanTests(TestCase):
+    """Фильтры списка рецептов и множества пользователя читают индексы."""
+
+    TAGS_INDEX = 'recipes_recipe_tags_tag_recipe_idx'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='plan_viewer', email='plan_viewer@example.com'
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'plan {i}', slug=f'plan_{i}')
+            for i in range(3)
+        ]
+        for i in range(6):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'plan {i}', text='plan',
+                cooking_time=10,
+            )
+            recipe.tags.set(cls.tags[i % 3:i % 3 + 2])
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipes=recipe)
+            else:
+                ShoppingCart.objects.create(user=cls.user, recipes=recipe)
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # На маленьких таблицах планировщик выбирает полное
+            # сканирование даже при наличии индекса.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def full_scans(self, plan, tables):
+        """Таблицы из tables, которые читаются полным сканированием."""
+        scanned = set()
+        for line in plan.splitlines():
+            for table in tables:
+                if connection.vendor == 'postgresql':
+                    if re.search(rf'Seq Scan on {table}\b', line):
+                        scanned.add(table)
+                elif re.search(rf'\bSCAN {table}\b', line) and (
+                    'INDEX' not in line
+                ):
+                    scanned.add(table)
+        return scanned
+
+    def test_membership_uses_unique_indexes(self):
+        plan = membership_query(self.user.id).explain()
+        self.assertEqual(
+            self.full_scans(plan, (
+                Favorite._meta.db_table, ShoppingCart._meta.db_table
+            )),
+            set(),
+            plan,
+        )
+
+    def test_recipe_filters_use_indexes(self):
+        request = SimpleNamespace(user=self.user)
+        slugs = [tag.slug for tag in self.tags[:2]]
+        for with_tags, favorited, in_cart in itertools.product(
+            (False, True), (None, 0, 1), (None, 0, 1)
+        ):
+            data = {}
+            if with_tags:
+                data['tags'] = slugs
+            if favorited is not None:
+                data['is_favorited'] = favorited
+            if in_cart is not None:
+                data['is_in_shopping_cart'] = in_cart
+            with self.subTest(**data):
+                filterset = RecipesFilter(
+                    data, queryset=Recipe.objects.all(), request=request
+                )
+                self.assertTrue(filterset.is_valid(), filterset.errors)
+                if filterset.qs.query.is_empty():
+                    continue
+                plan = filterset.qs.explain()
+                self.assertEqual(
+                    self.full_scans(plan, (
+                        Recipe.tags.through._meta.db_table,
+                    )),
+                    set(),
+                    plan,
+                )
+
+    def test_tag_lookup_uses_tag_recipe_index(self):
+        # Рецепты по тегам без перебора рецептов (полусоединение EXISTS).
+        plan = Recipe.tags.through.objects.filter(
+            tag_id__in=[tag.id for tag in self.tags[:2]]
+        ).values('recipe_id').explain()
+        self.assertIn(self.TAGS_INDEX, plan)
+
+
+class PantryIndexTests(TestCase):
+    """Индекс не трогает чужие id, если recipes и postings разошлись."""
+
+    def setUp(self):
+        self.index = PantryIndex()
+        self.index.postings = {
+            1: np.array([2, 5], dtype=np.int64),
+            2: np.array([3], dtype=np.int64),
+        }
+        self.index.recipes = {4: frozenset({1, 2, 3}), 9: frozenset({1})}
+
+    def postings(self):
+        return {
+            ingredient_id: ids.tolist()
+            for ingredient_id, ids in self.index.postings.items()
+        }
+
+    def test_remove_missing_id(self):
+        self.index.remove(4)
+        self.index.remove(9)
+        self.assertEqual(self.postings(), {1: [2, 5], 2: [3]})
+        self.assertEqual(self.index.recipes, {})
+
+    def test_update_twice(self):
+        self.index.update(5, [1, 2])
+        self.index.update(5, [1, 2])
+        self.assertEqual(self.postings(), {1: [2, 5], 2: [3, 5]})
+
+
+class MediaReleaseTests(TestCase):
+    """Замененный файл удаляется без повторного чтения записи."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        grace = mock.patch('api.storage.MEDIA_GC_GRACE', -1)
+        grace.start()
+        self.addCleanup(grace.stop)
+        author = User.objects.create(
+            username='media_author', email='media_author@example.com'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=author, name='media', text='media', cooking_time=10,
+                image=SimpleUploadedFile('old.png', b'old'),
+            )
+        self.recipe = Recipe.objects.get(pk=recipe.pk)
+
+    def test_replaced_image_is_released(self):
+        old = self.recipe.image.name
+        self.recipe.image = SimpleUploadedFile('new.png', b'new')
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.recipe.save()
+        before_update = itertools.takewhile(
+            lambda query: not query['sql'].startswith('UPDATE'),
+            queries.captured_queries,
+        )
+        self.assertFalse([
+            query['sql'] for query in before_update
+            if query['sql'].startswith('SELECT')
+        ])
+        self.assertFalse(default_storage.exists(old))
+        self.assertTrue(default_storage.exists(self.recipe.image.name))
+
+    def test_other_fields_keep_image(self):
+        old = self.recipe.image.name
+        self.recipe.name = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.save()
+        self.assertTrue(default_storage.exists(old))
+
+
+class SingleFlightTests(TestCase):
+    """Пока пересчет идет в другом воркере, ключ не пересчитывается."""
+
+    key = 'single_flight'
+
+    def setUp(self):
+        cache.clear()
+        # Аренду держит другой воркер.
+        cache.shared.add('lease:' + cache.local_key(self.key), True)
+
+    def compute(self):
+        self.fail('значение пересчитано без аренды')
+
+    def test_previous_generation_is_served(self):
+        cache.set(self.key, ('old', time.time() + 60, 0.0, 1))
+        self.assertEqual(
+            cache.get_or_compute(self.key, self.compute, 60, generation=2),
+            'old',
+        )
+
+    def test_waiter_backs_off(self):
+        with CaptureQueriesContext(connection) as queries:
+            value = cache.get_or_compute(self.key, lambda: 'own', 60)
+        self.assertEqual(value, 'own')
+        # Первое чтение и опросы общего кеша; попытка взять аренду не
+        # считается.
+        reads = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "cache_key", "value"')
+        ]
+        self.assertLessEqual(len(reads), 6)
+
+
+class LeaseDeadlineTests(TestCase):
+    """Аренда кеша освобождается и после истекшего срока запроса."""
+
+    key = 'deadline:lease'
+
+    def setUp(self):
+        cache.clear()
+        self.lease = 'lease:' + cache.local_key(self.key)
+
+    def slow_compute(self):
+        time.sleep(0.05)
+        return list(Tag.objects.all())
+
+    def test_lease_released_after_deadline(self):
+        with self.assertRaises(DeadlineExceeded):
+            with deadline(0.01):
+                cache.get_or_compute(self.key, self.slow_compute, 60)
+        self.assertIsNone(cache.shared.get(self.lease))
+
+    def test_next_request_recomputes(self):
+        with self.assertRaises(DeadlineExceeded):
+            with deadline(0.01):
+                cache.get_or_compute(self.key, self.slow_compute, 60)
+        calls = []
+
+        def compute():
+            calls.append(True)
+            return 'value'
+
+        self.assertEqual(cache.get_or_compute(self.key, compute, 60), 'value')
+        self.assertEqual(calls, [True])
+        # Значение посчитано под арендой и сохранено, а не после ожидания.
+        self.assertEqual(
+            cache.get_or_compute(self.key, lambda: 'other', 60), 'value'
+        )
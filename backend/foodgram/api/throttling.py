@@ -0,0 +1,163 @@
+"""Ограничение частоты и параллельности тяжелых запросов.
+
+Состояние хранится в локальном файле SQLite (settings.THROTTLE_STORE),
+поэтому все воркеры gunicorn на хосте соблюдают одни и те же лимиты.
+Частота ограничивается корзиной токенов: запас из num запросов
+пополняется со скоростью num за period, как в формате DRF "num/period".
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from api.const import CONCURRENCY_RETRY_AFTER, CONCURRENCY_SLOT_TTL
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class Overloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервер перегружен, повторите запрос позже.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait=CONCURRENCY_RETRY_AFTER):
+        super().__init__()
+        self.wait = wait
+
+
+class LocalStore:
+    """Счетчики в файле SQLite, общие для процессов одного хоста."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        # Соединение SQLite нельзя переносить через fork.
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'key TEXT PRIMARY KEY, tokens REAL, updated REAL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS slots ('
+                'token TEXT PRIMARY KEY, name TEXT, expires REAL)'
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def take(self, key, capacity, rate):
+        """Забирает токен из корзины.
+
+        Возвращает 0, если токен был, иначе время ожидания в секундах.
+        """
+        now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT tokens, updated FROM buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens = capacity if row is None else min(
+                capacity, row[0] + (now - row[1]) * rate
+            )
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)',
+                (key, tokens, now)
+            )
+        finally:
+            connection.execute('COMMIT')
+        return wait
+
+    def acquire(self, name, limit, ttl=CONCURRENCY_SLOT_TTL):
+        """Занимает слот из limit общих; None, если свободных нет."""
+        now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Слоты упавших воркеров освобождаются по истечении ttl.
+            connection.execute('DELETE FROM slots WHERE expires < ?', (now,))
+            busy, = connection.execute(
+                'SELECT COUNT(*) FROM slots WHERE name = ?', (name,)
+            ).fetchone()
+            if busy >= limit:
+                return None
+            token = uuid.uuid4().hex
+            connection.execute(
+                'INSERT INTO slots VALUES (?, ?, ?)', (token, name, now + ttl)
+            )
+            return token
+        finally:
+            connection.execute('COMMIT')
+
+    def release(self, token):
+        self.connection.execute('DELETE FROM slots WHERE token = ?', (token,))
+
+
+store = LocalStore(settings.THROTTLE_STORE)
+
+
+def parse_rate(rate):
+    """'10/min' -> (емкость корзины, токенов в секунду)."""
+    num, period = rate.split('/')
+    num = int(num)
+    return num, num / PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Корзина токенов для действия вьюсета.
+
+    Действие связывается с областью через view.throttle_scopes, лимит
+    берется из DEFAULT_THROTTLE_RATES по ключу '<область>.<kind>'.
+    Если лимит не задан или get_ident_key вернул None, запрос не
+    ограничивается. По умолчанию запросы считаются по адресу клиента
+    (get_ident с учетом NUM_PROXIES).
+    """
+    kind = 'ip'
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scopes', {}).get(view.action)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}.{self.kind}')
+        ident = self.get_ident_key(request)
+        if scope is None or rate is None or ident is None:
+            return True
+        capacity, refill = parse_rate(rate)
+        self.delay = store.take(
+            f'{scope}:{self.kind}:{ident}', capacity, refill
+        )
+        return not self.delay
+
+    def wait(self):
+        return self.delay
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'user'
+
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return None
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'ip'
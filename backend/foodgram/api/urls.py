@@ -3,9 +3,12 @@ from rest_framework import routers
 
 from api.views import (
     IngredientsViewset,
+    JobViewset,
     RecipeViewset,
     TagViewset,
     UserViewset,
+    profile,
+    sync,
 )
 
 app_name = 'api'
@@ -15,9 +18,12 @@ router.register(r'tags', TagViewset)
 router.register(r'ingredients', IngredientsViewset)
 router.register(r'users', UserViewset)
 router.register(r'recipes', RecipeViewset, basename='recipe')
+router.register(r'jobs', JobViewset, basename='job')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
+    path('profiles/<str:name>/', profile, name='profile'),
+    path('sync/', sync, name='sync'),
 ]
@@ -1,26 +1,52 @@
-import csv
+import hashlib
+import os
 
 from django.contrib.sites.shortcuts import get_current_site
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
-from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (
+    AllowAny,
+    IsAdminUser,
+    IsAuthenticated,
+)
 from rest_framework.response import Response
 
-from api.filters import RecipesFilter, IngredientFilter
-from api.mixins import PaginationMixins
-from api.pagination import CustomPagination
+from api import pantry
+from api.cache import RECIPE_LIST_VERSION, SHORT_LINK_KEY, version_of
+from api.const import (
+    BATCH_MAX_RECIPES,
+    EXPORT_ASYNC_MIN_RECIPES,
+    PANTRY_MAX_INGREDIENTS,
+    RECIPE_LIST_CACHE_TTL,
+    SHORT_LINK_CACHE_TTL,
+    SHORT_LINK_DB,
+)
+from api.feed import backfill, feed_recipe_ids, forget
+from api.filters import RecipesFilter
+from api.mixins import (
+    ConcurrencyLimitMixin,
+    DeadlineMixin,
+    PaginationMixins,
+    SparseFieldsetMixin,
+)
+from api.pagination import CustomPagination, FeedPagination
 from api.permissions import CreateUpadateDeletePermissions
+from api.profiling import profile_path
 from api.serializers import (
     AvatarUserSerializer,
     ChangePasswordSerializer,
     UpdateCreateRecipeSerializers,
     CreateUsersSerializer,
     FavoritesSerializer,
+    ForFavoritesandShoppingCartSerializer,
     IngredientsSerializer,
+    JobSerializer,
     ReadRecipeSerializer,
     ShoppingCartSerializer,
     ShortLinkSerializer,
@@ -28,50 +54,315 @@ from api.serializers import (
     TagSerializer,
     UsersSerializer,
 )
+from api.sync import (
+    changes_since,
+    empty_sections,
+    latest_token,
+    parse_token,
+)
+from api.tasks import (
+    SHOPPING_CART_EXPORT,
+    USER_DATA_EXPORT,
+    shopping_cart_ingredients,
+    write_shopping_cart_csv,
+)
+from api.throttling import IPTokenBucketThrottle, UserTokenBucketThrottle
+from jobs.models import Job
+from jobs.queue import enqueue, result_expired
 from recipes.models import (
-    ArrayIngredient,
     Favorite,
     Ingredient,
     Recipe,
     ShoppingCart,
     ShortLinkRecipe,
+    SimilarRecipe,
     Tag,
 )
+from recipes.reference import reference
 from users.models import Subscription, User
 
+# Фильтры, результат которых зависит от пользователя.
+USER_LIST_FILTERS = frozenset(('is_favorited', 'is_in_shopping_cart'))
+USER_MODEL_FIELDS = frozenset((
+    'email', 'username', 'first_name', 'last_name', 'avatar'
+))
+
+
+def reference_object(lookup, pk):
+    """Запись справочника из кеша процесса по pk из адреса или 404."""
+    try:
+        obj = lookup(int(pk))
+    except ValueError:
+        obj = None
+    if obj is None:
+        raise Http404
+    return obj
+
 
 class TagViewset(viewsets.ReadOnlyModelViewSet):
-    """Вьюсет тегов."""
+    """Вьюсет тегов, отдается из кеша процесса."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
 
+    def list(self, request):
+        serializer = self.get_serializer(reference.all_tags(), many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, pk):
+        obj = reference_object(reference.tag, pk)
+        return Response(self.get_serializer(obj).data)
+
 
 class IngredientsViewset(viewsets.ReadOnlyModelViewSet):
-    """Вьюсет ингредиентов."""
+    """Вьюсет ингредиентов, отдается из кеша процесса.
+
+    ?name= отбирает ингредиенты по началу названия без учета регистра.
+    """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientsSerializer
     permission_classes = (AllowAny,)
-    filter_backends = (IngredientFilter, )
-    search_fields = ('^name',)
 
+    def list(self, request):
+        serializer = self.get_serializer(
+            reference.search_ingredients(
+                request.query_params.get('name', '')
+            ),
+            many=True,
+        )
+        return Response(serializer.data)
+
+    def retrieve(self, request, pk):
+        obj = reference_object(reference.ingredient, pk)
+        return Response(self.get_serializer(obj).data)
 
-class RecipeViewset(viewsets.ModelViewSet, PaginationMixins):
+
+class RecipeViewset(
+    ConcurrencyLimitMixin,
+    DeadlineMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+    PaginationMixins
+):
     queryset = Recipe.objects.all()
     serializer_class = ReadRecipeSerializer
     permission_classes = (AllowAny, CreateUpadateDeletePermissions,)
     pagination_class = CustomPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipesFilter
+    throttle_classes = (UserTokenBucketThrottle, IPTokenBucketThrottle)
+    throttle_scopes = {
+        'download_shopping_cart': 'shopping_cart',
+        'shortlink': 'get_link',
+        'create': 'recipe_write',
+        'partial_update': 'recipe_write',
+    }
+    concurrency_limits = {
+        'download_shopping_cart': 'heavy',
+        'create': 'heavy',
+        'partial_update': 'heavy',
+        'pantry': 'heavy',
+    }
+    deadlines = {
+        'list': 'list',
+        'download_shopping_cart': 'export',
+    }
 
     def get_serializer_class(self):
         if self.request.method == 'POST' or self.request.method == 'PATCH':
             return UpdateCreateRecipeSerializers
         return ReadRecipeSerializer
 
+    def list(self, request, *args, **kwargs):
+        """Страница id рецептов общая для всех, флаги - свои.
+
+        Списки с фильтрами по избранному и корзине зависят от
+        пользователя и не кешируются.
+        """
+        if self.paginator is None or (
+            request.user.is_authenticated
+            and USER_LIST_FILTERS & set(request.query_params)
+        ):
+            return super().list(request, *args, **kwargs)
+        # Ссылки next и previous строятся из адреса запроса.
+        key = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        # Версия списка - поколение: после изменения рецепта прежняя
+        # страница отдается, пока один воркер считает новую.
+        page = cache.get_or_compute(
+            f'recipe_list:{key}',
+            self.list_page,
+            RECIPE_LIST_CACHE_TTL,
+            generation=version_of(RECIPE_LIST_VERSION),
+        )
+        recipes = Recipe.objects.only('id', 'author').in_bulk(page['ids'])
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page['ids'] if pk in recipes],
+            many=True
+        )
+        if 'count' not in page:
+            return Response(serializer.data)
+        return Response({
+            'count': page['count'],
+            'next': page['next'],
+            'previous': page['previous'],
+            'results': serializer.data,
+        })
+
+    def list_page(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return {'ids': list(queryset.values_list('id', flat=True))}
+        return {
+            'count': self.paginator.page.paginator.count,
+            'next': self.paginator.get_next_link(),
+            'previous': self.paginator.get_previous_link(),
+            'ids': [recipe.id for recipe in page],
+        }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # Остальное ReadRecipeSerializer берет из документов рецептов.
+            return queryset.only('id', 'author')
+        return queryset
+
     def perform_create(self, serializer):
         return serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        recipe_id = instance.id
+        instance.delete()
+        pantry.index.remove(recipe_id)
+
+    def get_pantry_ingredients(self, request):
+        raw = request.query_params.get('ingredients', '')
+        try:
+            ingredients = {int(value) for value in raw.split(',') if value}
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Ожидается список id через запятую.'}
+            )
+        if not ingredients or len(ingredients) > PANTRY_MAX_INGREDIENTS:
+            raise ValidationError(
+                {'ingredients': (
+                    'Укажите от 1 до '
+                    f'{PANTRY_MAX_INGREDIENTS} ингредиентов.'
+                )}
+            )
+        return ingredients
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_path='pantry',
+    )
+    def pantry(self, request):
+        """Что можно приготовить из имеющихся ингредиентов.
+
+        Рецепты сортируются по доле имеющихся ингредиентов и числу
+        недостающих. Остальные параметры фильтрации рецептов
+        (tags, author, ...) применяются как в списке рецептов.
+        """
+        allowed = None
+        if set(request.query_params) & set(self.filterset_class.base_filters):
+            allowed = self.filter_queryset(
+                self.get_queryset()
+            ).values_list('id', flat=True)
+        ranks = pantry.index.rank(
+            self.get_pantry_ingredients(request),
+            allowed=allowed
+        )
+        page = self.paginate_queryset(list(ranks))
+        ids = list(ranks) if page is None else page
+        recipes = Recipe.objects.only('id', 'author').in_bulk(ids)
+        recipes = [recipes[pk] for pk in ids if pk in recipes]
+        serializer = ReadRecipeSerializer(
+            recipes,
+            many=True,
+            context=self.get_serializer_context()
+        )
+        data = serializer.data
+        for item, recipe in zip(data, recipes):
+            item['coverage'], item['missing'] = ranks[recipe.id]
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=(IsAuthenticated,),
+        url_path='feed',
+    )
+    def feed(self, request):
+        """Лента рецептов от авторов из подписок."""
+        paginator = FeedPagination()
+        ids = paginator.paginate_ids(
+            request,
+            lambda before, limit: feed_recipe_ids(
+                request.user, before=before, limit=limit
+            )
+        )
+        recipes = Recipe.objects.only('id', 'author').in_bulk(ids)
+        serializer = ReadRecipeSerializer(
+            [recipes[pk] for pk in ids if pk in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_path='batch',
+    )
+    def batch(self, request):
+        """Несколько рецептов по id в порядке запроса."""
+        raw = request.query_params.get('ids', '')
+        try:
+            ids = list(dict.fromkeys(
+                int(value) for value in raw.split(',') if value
+            ))
+        except ValueError:
+            raise ValidationError(
+                {'ids': 'Ожидается список id через запятую.'}
+            )
+        if not ids or len(ids) > BATCH_MAX_RECIPES:
+            raise ValidationError(
+                {'ids': f'Укажите от 1 до {BATCH_MAX_RECIPES} рецептов.'}
+            )
+        recipes = Recipe.objects.only('id', 'author').in_bulk(ids)
+        serializer = ReadRecipeSerializer(
+            [recipes[pk] for pk in ids if pk in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return Response({
+            'results': serializer.data,
+            'missing': [pk for pk in ids if pk not in recipes],
+        })
+
+    @action(
+        detail=True,
+        methods=['GET'],
+        url_path='similar',
+    )
+    def similar(self, request, pk):
+        """Похожие рецепты из заранее рассчитанной таблицы."""
+        recipe = get_object_or_404(Recipe, id=pk)
+        recipes = [
+            item.similar for item in SimilarRecipe.objects.filter(
+                recipe=recipe
+            ).select_related('similar').order_by('-score')
+        ]
+        serializer = ForFavoritesandShoppingCartSerializer(
+            recipes,
+            many=True,
+            context={'request': request}
+        )
+        return Response(serializer.data)
+
     @action(
         detail=True,
         url_path='get-link',
@@ -149,15 +440,7 @@ class RecipeViewset(viewsets.ModelViewSet, PaginationMixins):
         response['Content-Disposition'] = (
             'attachment; filename="product_list.csv"'
         )
-        writer = csv.writer(response)
-        for product in ingredients:
-            writer.writerow(
-                [
-                    product.get('ingredients__name'),
-                    product.get('quantity'),
-                    product.get('ingredients__measurement_unit'),
-                ]
-            )
+        write_shopping_cart_csv(response, ingredients)
         return response
 
     @action(
@@ -167,38 +450,122 @@ class RecipeViewset(viewsets.ModelViewSet, PaginationMixins):
         url_path='download_shopping_cart'
     )
     def download_shopping_cart(self, request):
+        """Список покупок.
+
+        Большие списки собираются в фоне: в ответ приходит задача,
+        готовый файл забирается через /api/jobs/{id}/.
+        """
         author = request.user
-        ingredients = ArrayIngredient.objects.filter(
-            recipes__shopping_list__user=author
-        ).values(
-            'ingredients__name',
-            'ingredients__measurement_unit'
-        ).annotate(
-            quantity=Sum('amount')
+        if request.query_params.get('async') or (
+            ShoppingCart.objects.filter(user=author).count()
+            >= EXPORT_ASYNC_MIN_RECIPES
+        ):
+            job = enqueue(SHOPPING_CART_EXPORT, user=author)
+            serializer = JobSerializer(job, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        return self.download_csv(shopping_cart_ingredients(author))
+
+
+class JobViewset(viewsets.ReadOnlyModelViewSet, PaginationMixins):
+    """Вьюсет фоновых задач пользователя."""
+    serializer_class = JobSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    @action(detail=True, methods=['GET'])
+    def download(self, request, pk=None):
+        """Файл результата; чужие задачи не находятся."""
+        job = self.get_object()
+        if not job.result or result_expired(job):
+            raise Http404
+        return FileResponse(
+            job.result.open('rb'),
+            as_attachment=True,
+            filename=os.path.basename(job.result.name),
         )
-        return self.download_csv(ingredients)
 
 
 def redirection(request, shortlink):
-    return redirect(
-        get_object_or_404(
-            ShortLinkRecipe,
+    if len(shortlink) > SHORT_LINK_DB:
+        raise Http404
+    full_link = cache.get_or_compute(
+        SHORT_LINK_KEY.format(shortlink),
+        lambda: ShortLinkRecipe.objects.filter(
             shortlink=shortlink
-        ).full_link
+        ).values_list('full_link', flat=True).first(),
+        SHORT_LINK_CACHE_TTL,
     )
+    if full_link is None:
+        raise Http404
+    return redirect(full_link)
+
 
+@api_view(('GET',))
+@permission_classes((IsAdminUser,))
+def profile(request, name):
+    path = profile_path(name)
+    if path is None or not os.path.exists(path):
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
 
-class UserViewset(viewsets.ModelViewSet, PaginationMixins):
+
+@api_view(('GET',))
+@permission_classes((IsAuthenticated,))
+def sync(request):
+    """Изменения данных пользователя после токена since."""
+    if 'since' not in request.query_params:
+        token, has_more, sections = (
+            latest_token(request.user), False, empty_sections()
+        )
+    else:
+        token, has_more, sections = changes_since(
+            request.user, parse_token(request.query_params['since'])
+        )
+    recipe_ids = sections['recipes']['changed']
+    if recipe_ids:
+        recipes = Recipe.objects.only('id', 'author').in_bulk(recipe_ids)
+        sections['recipes']['changed'] = ReadRecipeSerializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True,
+            context={'request': request}
+        ).data
+    return Response({'token': token, 'has_more': has_more, **sections})
+
+
+class UserViewset(
+    DeadlineMixin,
+    SparseFieldsetMixin,
+    viewsets.ModelViewSet,
+    PaginationMixins
+):
     """Вьюсет пользователя."""
     queryset = User.objects.all()
     serializer_class = UsersSerializer
     permission_classes = (AllowAny,)
+    throttle_classes = (UserTokenBucketThrottle, IPTokenBucketThrottle)
+    throttle_scopes = {
+        'list': 'users_list',
+        'export_data': 'user_export',
+    }
+    deadlines = {
+        'subscriptions': 'list',
+    }
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return CreateUsersSerializer
         return UsersSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            return queryset.only('id', *(
+                self.requested_fields(UsersSerializer) & USER_MODEL_FIELDS
+            ))
+        return queryset
+
     @action(detail=False, url_path='me', permission_classes=(IsAuthenticated,))
     def user_me(self, request):
         """Просмотр профиля пользователя."""
@@ -228,6 +595,18 @@ class UserViewset(viewsets.ModelViewSet, PaginationMixins):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        url_path='me/export',
+        methods=['POST'],
+        permission_classes=(IsAuthenticated,)
+    )
+    def export_data(self, request):
+        """Выгрузка данных пользователя в фоне."""
+        job = enqueue(USER_DATA_EXPORT, user=request.user)
+        serializer = JobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
     @action(
         detail=False,
         url_path='set_password',
@@ -253,12 +632,14 @@ class UserViewset(viewsets.ModelViewSet, PaginationMixins):
     )
     def subscriptions(self, request):
         user = request.user
-        queryset = Subscription.objects.filter(user=user)
+        queryset = Subscription.objects.filter(
+            user=user
+        ).select_related('following')
         pages = self.paginate_queryset(queryset)
         serializer = SubscriptionsUserSerializer(
             pages,
             many=True,
-            context={'request': request}
+            context=self.get_serializer_context()
         )
         return self.get_paginated_response(serializer.data)
 
@@ -277,16 +658,19 @@ class UserViewset(viewsets.ModelViewSet, PaginationMixins):
         if request.method != 'POST':
             try:
                 followings.delete()
+                forget(user, subscribed)
                 return Response(status=status.HTTP_204_NO_CONTENT)
             except Exception:
                 return Response(
                     'Вы не подписаны на данного пользователя',
                     status=status.HTTP_400_BAD_REQUEST
                 )
-        create_followings = Subscription.objects.create(
-            user=user,
-            following=subscribed
-        )
+        with transaction.atomic():
+            create_followings = Subscription.objects.create(
+                user=user,
+                following=subscribed
+            )
+        backfill(user, subscribed)
         serializer = SubscriptionsUserSerializer(
             create_followings,
             context={'request': request}
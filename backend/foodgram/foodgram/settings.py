@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from django.core.management.utils import get_random_secret_key
@@ -29,9 +30,12 @@ INSTALLED_APPS = [
     'recipes.apps.RecipesConfig',
     'api.apps.ApiConfig',
     'users.apps.UsersConfig',
+    'jobs.apps.JobsConfig',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.cache.CacheBatchMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -41,6 +45,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'api.slow_queries.SlowQueryMiddleware',
+    'api.profiling.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -74,6 +80,28 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT', 5432)
     }
 }
+if os.getenv('SQLITE_DB'):
+    # Локальный запуск без PostgreSQL, например тестов.
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('SQLITE_DB'),
+    }
+
+# Кеш в памяти процесса поверх общей таблицы cache_table
+# (manage.py createcachetable), время жизни задаётся в shared.
+CACHES = {
+    'default': {
+        'BACKEND': 'api.cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'cache_table',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -98,8 +126,59 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated'],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication'],
+    'DEFAULT_THROTTLE_RATES': {
+        'shopping_cart.user': '10/min',
+        'shopping_cart.ip': '30/min',
+        'get_link.user': '30/min',
+        'get_link.ip': '60/min',
+        'recipe_write.user': '30/hour',
+        'recipe_write.ip': '60/hour',
+        'users_list.ip': '60/min',
+        'user_export.user': '5/hour',
+    },
+    # Перед gunicorn стоит nginx: адрес клиента берется из последнего
+    # значения X-Forwarded-For, без заголовка - из REMOTE_ADDR.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1)),
+}
+
+THROTTLE_STORE = os.getenv(
+    'THROTTLE_STORE',
+    os.path.join(tempfile.gettempdir(), 'foodgram_throttle.sqlite3')
+)
+
+CONCURRENCY_LIMITS = {
+    'heavy': int(os.getenv('HEAVY_REQUESTS_LIMIT', 4)),
+}
+
+# Сроки тяжелых действий в секундах, меньше таймаута воркера gunicorn.
+REQUEST_DEADLINES = {
+    'list': float(os.getenv('LIST_DEADLINE', 3)),
+    'export': float(os.getenv('EXPORT_DEADLINE', 10)),
 }
 
+# Без токена /api/metrics закрыт (403).
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Порог медленного запроса в миллисекундах, без него журнал выключен.
+SLOW_QUERY_THRESHOLD = (
+    float(os.getenv('SLOW_QUERY_THRESHOLD'))
+    if os.getenv('SLOW_QUERY_THRESHOLD') else None
+)
+
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_RATE', 0.1))
+
+SLOW_QUERY_LOG = os.getenv(
+    'SLOW_QUERY_LOG',
+    os.path.join(tempfile.gettempdir(), 'foodgram_slow_queries.jsonl')
+)
+
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'False') == 'True'
+
+PROFILER_DIR = os.getenv(
+    'PROFILER_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram_profiles')
+)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'SERIALIZERS': {
@@ -133,5 +212,8 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = 'api.storage.ContentAddressedStorage'
+# Результаты фоновых задач, закрытые от nginx (jobs.storage).
+EXPORTS_ROOT = os.getenv('EXPORTS_ROOT', os.path.join(BASE_DIR, 'exports'))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
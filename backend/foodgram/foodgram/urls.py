@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.urls import include, path
 
+from api.metrics import metrics
 from api.views import redirection
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/metrics', metrics, name='metrics'),
     path('api/', include('api.urls')),
     path('s/<shortlink>/', redirection, name='redirection'),
 ]
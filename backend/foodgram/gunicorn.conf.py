@@ -0,0 +1,23 @@
+import os
+import shutil
+import tempfile
+
+# Воркеры наследуют переменную и пишут метрики в общий каталог.
+METRICS_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram_metrics')
+)
+
+
+def on_starting(server):
+    # Метрики прошлого запуска не должны суммироваться с новыми.
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # prometheus_client выбирает хранилище значений при импорте, поэтому
+    # импортируется после настройки PROMETHEUS_MULTIPROC_DIR.
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
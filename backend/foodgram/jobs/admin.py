@@ -0,0 +1,21 @@
+from django.contrib import admin
+
+from jobs.models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'kind',
+        'user',
+        'status',
+        'attempts',
+        'created_at',
+        'finished_at',
+    )
+    list_filter = ('status', 'kind')
+    list_select_related = ('user',)
+    readonly_fields = ('dedup_key', 'created_at', 'started_at', 'finished_at')
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,78 @@
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.cache import prune_invalidations
+from api.const import JOB_POLL_INTERVAL, JOB_TIMEOUT, JOB_WORKERS
+from api.sync import prune_changes
+from jobs.queue import autodiscover, expire_results, requeue_stale, work
+
+
+class Command(BaseCommand):
+    help = 'Запускает пул процессов для выполнения фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=JOB_WORKERS,
+            help='Количество процессов-воркеров',
+        )
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=JOB_POLL_INTERVAL,
+            help='Пауза между опросами пустой очереди, сек.',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить накопившиеся задачи и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        autodiscover()
+        requeue_stale()
+        expire_results()
+        prune_invalidations()
+        prune_changes()
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+
+        def shutdown(signum, frame):
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        # Соединения нельзя делить между процессами после fork.
+        connections.close_all()
+        workers = [
+            context.Process(
+                target=work,
+                args=(options['poll'], stop, options['once']),
+                daemon=True,
+            )
+            for _ in range(max(options['processes'], 1))
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(
+            f'Запущено воркеров: {len(workers)}'
+        )
+        last_check = time.monotonic()
+        while any(worker.is_alive() for worker in workers):
+            if stop.wait(options['poll']):
+                break
+            if time.monotonic() - last_check > JOB_TIMEOUT / 2:
+                requeue_stale()
+                expire_results()
+                prune_invalidations()
+                prune_changes()
+                connections.close_all()
+                last_check = time.monotonic()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('Воркеры остановлены'))
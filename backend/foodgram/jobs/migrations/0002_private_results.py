@@ -0,0 +1,30 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:31
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+import jobs.storage
+
+
+def drop_public_results(apps, schema_editor):
+    """Прежние выгрузки лежали в открытом каталоге media."""
+    Job = apps.get_model('jobs', 'Job')
+    jobs = Job.objects.filter(result__startswith='exports/')
+    for name in jobs.values_list('result', flat=True):
+        default_storage.delete(name)
+    jobs.update(result=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_public_results, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='job',
+            name='result',
+            field=models.FileField(blank=True, default=None, null=True, storage=jobs.storage.export_storage, upload_to=jobs.storage.export_path, verbose_name='Результат'),
+        ),
+    ]
@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.db import models
+
+from api.const import JOB_DEDUP_KEY_LENGTH, JOB_KIND_MAX_LENGTH
+from jobs.storage import export_path, export_storage
+
+User = get_user_model()
+
+
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+    IN_FLIGHT = (PENDING, RUNNING)
+
+    kind = models.CharField(
+        max_length=JOB_KIND_MAX_LENGTH,
+        verbose_name='Тип задачи',
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        verbose_name='Пользователь',
+        null=True,
+        blank=True,
+    )
+    payload = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Параметры',
+    )
+    dedup_key = models.CharField(
+        max_length=JOB_DEDUP_KEY_LENGTH,
+        verbose_name='Ключ дедупликации',
+    )
+    status = models.CharField(
+        max_length=max(len(status) for status, _ in STATUSES),
+        choices=STATUSES,
+        default=PENDING,
+        verbose_name='Статус',
+    )
+    result = models.FileField(
+        upload_to=export_path,
+        storage=export_storage,
+        verbose_name='Результат',
+        null=True,
+        default=None,
+        blank=True,
+    )
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Попытки',
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создана',
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Запущена',
+    )
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Завершена',
+    )
+
+    class Meta:
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+        ordering = ('-id',)
+        indexes = (
+            models.Index(
+                fields=('status', 'id'),
+                name='job_status_idx',
+            ),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('dedup_key',),
+                condition=models.Q(status__in=('pending', 'running')),
+                name='Unique job in flight',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+    @property
+    def in_flight(self):
+        return self.status in self.IN_FLIGHT
@@ -0,0 +1,158 @@
+"""Очередь фоновых задач поверх таблицы Job.
+
+Брокер не нужен: задачи хранятся в основной базе, а воркеры забирают
+их условным UPDATE, который атомарен и в PostgreSQL, и в SQLite.
+"""
+import hashlib
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from api.const import JOB_MAX_ATTEMPTS, JOB_RESULT_TTL, JOB_TIMEOUT
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def task(kind):
+    """Регистрирует обработчик задач типа kind.
+
+    Обработчик получает объект Job и может вернуть ContentFile,
+    который сохраняется в Job.result.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def autodiscover():
+    """Импортирует модули tasks всех приложений."""
+    autodiscover_modules('tasks')
+
+
+def make_dedup_key(kind, user=None, payload=None):
+    raw = json.dumps(
+        [kind, getattr(user, 'pk', user), payload or {}],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def enqueue(kind, user=None, payload=None):
+    """Ставит задачу в очередь.
+
+    Если такая же задача еще не завершена, возвращается она.
+    """
+    payload = payload or {}
+    dedup_key = make_dedup_key(kind, user, payload)
+    for _ in range(JOB_MAX_ATTEMPTS):
+        job = Job.objects.filter(
+            dedup_key=dedup_key,
+            status__in=Job.IN_FLIGHT,
+        ).first()
+        if job:
+            return job
+        try:
+            with transaction.atomic():
+                return Job.objects.create(
+                    kind=kind,
+                    user=user,
+                    payload=payload,
+                    dedup_key=dedup_key,
+                )
+        except IntegrityError:
+            continue
+    raise RuntimeError(f'Не удалось поставить задачу {kind} в очередь')
+
+
+def claim_next():
+    """Забирает самую старую задачу из очереди."""
+    while True:
+        job = Job.objects.filter(
+            status=Job.PENDING
+        ).order_by('id').only('id').first()
+        if job is None:
+            return None
+        claimed = Job.objects.filter(
+            pk=job.pk,
+            status=Job.PENDING,
+        ).update(
+            status=Job.RUNNING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=job.pk)
+
+
+def run_job(job):
+    handler = _handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f'Неизвестный тип задачи: {job.kind}')
+        result = handler(job)
+        if result is not None:
+            job.result.save(result.name, result, save=False)
+    except Exception:
+        logger.exception('Задача %s завершилась с ошибкой', job)
+        job.status = Job.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = Job.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=('status', 'result', 'error', 'finished_at'))
+    return job
+
+
+def requeue_stale():
+    """Возвращает в очередь задачи, воркер которых не ответил вовремя."""
+    deadline = timezone.now() - timedelta(seconds=JOB_TIMEOUT)
+    stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=deadline)
+    stale.filter(attempts__gte=JOB_MAX_ATTEMPTS).update(
+        status=Job.FAILED,
+        error='Превышено время выполнения',
+        finished_at=timezone.now(),
+    )
+    return stale.update(status=Job.PENDING)
+
+
+def result_expired(job):
+    return job.finished_at is not None and (
+        job.finished_at < timezone.now() - timedelta(seconds=JOB_RESULT_TTL)
+    )
+
+
+def expire_results():
+    """Удаляет файлы результатов старше JOB_RESULT_TTL."""
+    expired = Job.objects.filter(
+        finished_at__lt=timezone.now() - timedelta(seconds=JOB_RESULT_TTL)
+    ).exclude(result='').exclude(result=None)
+    count = 0
+    for job in expired.only('id', 'result').iterator():
+        job.result.delete(save=False)
+        Job.objects.filter(pk=job.pk).update(result=None)
+        count += 1
+    return count
+
+
+def work(poll_interval, stop, once=False):
+    """Цикл воркера: выполняет задачи, пока не будет установлен stop."""
+    while not stop.is_set():
+        close_old_connections()
+        job = claim_next()
+        if job is None:
+            if once:
+                break
+            stop.wait(poll_interval)
+            continue
+        run_job(job)
@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+
+from jobs.models import Job
+
+
+def job_deleted(sender, instance, **kwargs):
+    """Удаляет файл результата вместе с задачей, например с пользователем."""
+    if instance.result:
+        transaction.on_commit(
+            lambda: instance.result.storage.delete(instance.result.name)
+        )
+
+
+def connect():
+    post_delete.connect(job_deleted, sender=Job)
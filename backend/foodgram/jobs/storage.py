@@ -0,0 +1,19 @@
+"""Хранилище результатов задач.
+
+Выгрузки содержат личные данные, поэтому лежат вне MEDIA_ROOT, который
+nginx отдает без авторизации, в случайных каталогах, и отдаются только
+владельцу задачи через /api/jobs/{id}/download/.
+"""
+import secrets
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+def export_storage():
+    return FileSystemStorage(location=settings.EXPORTS_ROOT)
+
+
+def export_path(job, filename):
+    # Имя нельзя угадать по id задачи.
+    return f'{secrets.token_urlsafe(16)}/{filename}'
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Count
 
 from recipes.models import (
     ArrayIngredient,
@@ -11,13 +12,38 @@ from recipes.models import (
 )
 
 
+class ArrayIngredientInline(admin.TabularInline):
+    model = ArrayIngredient
+    autocomplete_fields = ('ingredients',)
+    extra = 0
+    min_num = 1
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'recipes', 'ingredients'
+        )
+
+
 class RecipesAdmin(admin.ModelAdmin):
     list_display = (
         'name',
         'author',
+        'favorites_count',
     )
-    search_fields = ('name', 'author')
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username', 'author__email')
     list_filter = ('tags',)
+    autocomplete_fields = ('author',)
+    inlines = (ArrayIngredientInline,)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            favorites_count=Count('favorites', distinct=True)
+        )
+
+    @admin.display(description='В избранном', ordering='favorites_count')
+    def favorites_count(self, obj):
+        return obj.favorites_count
 
 
 class IngredientsAdmin(admin.ModelAdmin):
@@ -28,14 +54,49 @@ class IngredientsAdmin(admin.ModelAdmin):
     search_fields = ('name',)
 
 
+class TagAdmin(admin.ModelAdmin):
+    list_display = (
+        'name',
+        'slug',
+    )
+    search_fields = ('name', 'slug')
+
+
+class ArrayIngredientAdmin(admin.ModelAdmin):
+    list_display = (
+        'recipes',
+        'ingredients',
+        'amount',
+    )
+    list_select_related = ('recipes', 'ingredients')
+    search_fields = ('recipes__name', 'ingredients__name')
+    autocomplete_fields = ('recipes', 'ingredients')
+
+
+class FavoritesandShoppingCartAdmin(admin.ModelAdmin):
+    list_display = (
+        'user',
+        'recipes',
+    )
+    list_select_related = ('user', 'recipes')
+    search_fields = ('user__username', 'recipes__name')
+    autocomplete_fields = ('user', 'recipes')
+
+
 class ShortLinkRecipeAdmin(admin.ModelAdmin):
+    list_display = (
+        'shortlink',
+        'recipe',
+    )
+    list_select_related = ('recipe',)
     search_fields = ('shortlink',)
+    autocomplete_fields = ('recipe',)
 
 
-admin.site.register(Tag)
+admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientsAdmin)
 admin.site.register(Recipe, RecipesAdmin)
-admin.site.register(ArrayIngredient)
-admin.site.register(Favorite)
-admin.site.register(ShoppingCart)
-admin.site.register(ShortLinkRecipe)
+admin.site.register(ArrayIngredient, ArrayIngredientAdmin)
+admin.site.register(Favorite, FavoritesandShoppingCartAdmin)
+admin.site.register(ShoppingCart, FavoritesandShoppingCartAdmin)
+admin.site.register(ShortLinkRecipe, ShortLinkRecipeAdmin)
@@ -0,0 +1,132 @@
+"""Денормализованные документы рецептов.
+
+Документ хранит не зависящую от зрителя часть ответа ReadRecipeSerializer:
+теги, публичные поля автора, ингредиенты с количеством. Изображения
+хранятся именами файлов, абсолютные ссылки строятся при чтении.
+Документ пересобирается сигналами (recipes.signals) после сохранения
+рецепта, его ингредиентов, тегов и профиля автора.
+"""
+import threading
+
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from recipes.models import ArrayIngredient, Recipe, RecipeDocument
+
+AUTHOR_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+
+_pending = threading.local()
+
+
+def document_data(recipe, author, tags, ingredients):
+    """Документ рецепта; ingredients - пары (ингредиент, количество)."""
+    return {
+        'id': recipe.id,
+        'tags': [
+            {'id': tag.id, 'name': tag.name, 'slug': tag.slug}
+            for tag in sorted(tags, key=lambda tag: tag.id)
+        ],
+        'author': {
+            **{field: getattr(author, field) for field in AUTHOR_FIELDS},
+            'avatar': author.avatar.name or None,
+        },
+        'ingredients': [
+            {
+                'id': ingredient.id,
+                'name': ingredient.name,
+                'measurement_unit': ingredient.measurement_unit,
+                'amount': amount,
+            }
+            for ingredient, amount in ingredients
+        ],
+        'name': recipe.name,
+        'image': recipe.image.name or None,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+    }
+
+
+def build_document(recipe):
+    """Документ рецепта с предзагруженными автором, тегами и ингредиентами."""
+    return document_data(
+        recipe,
+        recipe.author,
+        recipe.tags.all(),
+        (
+            (item.ingredients, item.amount)
+            for item in recipe.array_ingredients.all()
+        ),
+    )
+
+
+def source_queryset():
+    return Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'array_ingredients',
+            queryset=ArrayIngredient.objects.select_related(
+                'ingredients'
+            ).order_by('id'),
+        ),
+    )
+
+
+def rebuild(recipe_ids):
+    """Пересобирает документы рецептов и возвращает их по id."""
+    now = timezone.now()
+    documents = {
+        recipe.id: RecipeDocument(
+            recipe=recipe, data=build_document(recipe), updated_at=now
+        )
+        for recipe in source_queryset().filter(id__in=list(recipe_ids))
+    }
+    existing = set(
+        RecipeDocument.objects.filter(
+            recipe_id__in=list(documents)
+        ).values_list('recipe_id', flat=True)
+    )
+    RecipeDocument.objects.bulk_update(
+        [doc for pk, doc in documents.items() if pk in existing],
+        ('data', 'updated_at'),
+    )
+    RecipeDocument.objects.bulk_create(
+        [doc for pk, doc in documents.items() if pk not in existing],
+        ignore_conflicts=True,
+    )
+    return documents
+
+
+def _flush():
+    recipe_ids = getattr(_pending, 'ids', set())
+    _pending.ids = set()
+    if recipe_ids:
+        rebuild(recipe_ids)
+
+
+def schedule_rebuild(recipe_ids):
+    """Пересборка после фиксации транзакции, одна на все изменения."""
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return
+    if not connection.in_atomic_block:
+        rebuild(recipe_ids)
+        return
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    _pending.ids.update(recipe_ids)
+    transaction.on_commit(_flush)
+
+
+def store(recipe_id, data, created=False):
+    """Сохраняет документ, собранный из данных в памяти.
+
+    Отменяет запланированную пересборку этого рецепта, поэтому
+    вызывается после всех изменений рецепта в транзакции.
+    """
+    getattr(_pending, 'ids', set()).discard(recipe_id)
+    if not created and RecipeDocument.objects.filter(
+        recipe_id=recipe_id
+    ).update(data=data, updated_at=timezone.now()):
+        return
+    RecipeDocument.objects.create(recipe_id=recipe_id, data=data)
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.const import SIMILAR_RECIPES_TAG_WEIGHT, SIMILAR_RECIPES_TOP_K
+from recipes.models import Recipe, SimilarityRun
+from recipes.similarity import JACCARD, METRICS, build
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает похожие рецепты. По умолчанию обрабатываются '
+        'только рецепты, измененные после прошлого запуска'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать все рецепты',
+        )
+        parser.add_argument(
+            '--metric',
+            choices=METRICS,
+            default=JACCARD,
+        )
+        parser.add_argument(
+            '--tag-weight',
+            type=float,
+            default=SIMILAR_RECIPES_TAG_WEIGHT,
+            help='Вес совпадающего тега относительно ингредиента',
+        )
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=SIMILAR_RECIPES_TOP_K,
+        )
+
+    def handle(self, *args, **options):
+        params = {
+            'metric': options['metric'],
+            'tag_weight': options['tag_weight'],
+            'k': options['top_k'],
+        }
+        last = SimilarityRun.objects.first()
+        started_at = timezone.now()
+        changed = None
+        # При смене параметров старые оценки несравнимы с новыми.
+        if not options['full'] and last and last.params == params:
+            changed = Recipe.objects.filter(
+                updated_at__gte=last.started_at
+            ).values_list('id', flat=True)
+        start = time.monotonic()
+        count = build(changed=changed, **params)
+        SimilarityRun.objects.create(
+            params=params, recipes=count, started_at=started_at
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рецептов: {count} '
+            f'за {time.monotonic() - start:.1f} с'
+        ))
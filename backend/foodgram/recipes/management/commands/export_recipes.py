@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from recipes.models import ArrayIngredient, Recipe
+
+CHUNK_SIZE = 1000
+RECIPES_FILE = 'recipes.jsonl'
+IMAGES_DIR = 'images'
+
+
+def iter_recipes(chunk_size=CHUNK_SIZE):
+    """Рецепты в виде словарей для переноса между базами.
+
+    Рецепты читаются пачками по id, поэтому в памяти одновременно
+    находится не больше chunk_size рецептов с тегами и ингредиентами.
+    """
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'array_ingredients',
+            queryset=ArrayIngredient.objects.select_related(
+                'ingredients'
+            ).order_by('id'),
+        ),
+    ).order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        for recipe in chunk:
+            yield recipe, {
+                'author': recipe.author.email,
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'image': (
+                    os.path.basename(recipe.image.name)
+                    if recipe.image else None
+                ),
+                'tags': [
+                    {'name': tag.name, 'slug': tag.slug}
+                    for tag in recipe.tags.all()
+                ],
+                'ingredients': [
+                    {
+                        'name': item.ingredients.name,
+                        'measurement_unit': item.ingredients.measurement_unit,
+                        'amount': item.amount,
+                    }
+                    for item in recipe.array_ingredients.all()
+                ],
+            }
+        last_id = chunk[-1].id
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает рецепты в каталог: recipes.jsonl по рецепту в строке '
+        'и изображения в images/'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Каталог для выгрузки')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument(
+            '--no-images',
+            action='store_true',
+            help='Не копировать файлы изображений',
+        )
+
+    def handle(self, *args, **options):
+        images = os.path.join(options['path'], IMAGES_DIR)
+        os.makedirs(images, exist_ok=True)
+        start = time.monotonic()
+        count = 0
+        with open(
+            os.path.join(options['path'], RECIPES_FILE), 'w', encoding='utf-8'
+        ) as file:
+            for recipe, data in iter_recipes(options['chunk_size']):
+                if data['image'] and not options['no_images']:
+                    if default_storage.exists(recipe.image.name):
+                        with default_storage.open(recipe.image.name) as src:
+                            with open(
+                                os.path.join(images, data['image']), 'wb'
+                            ) as dst:
+                                shutil.copyfileobj(src, dst)
+                    else:
+                        data['image'] = None
+                file.write(json.dumps(data, ensure_ascii=False) + '\n')
+                count += 1
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {count} за {elapsed:.1f} с '
+            f'({count / max(elapsed, 1e-6):.0f} в секунду)'
+        ))
@@ -0,0 +1,245 @@
+import hashlib
+import itertools
+import json
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import get_available_image_extensions
+from django.db import connection, transaction
+
+from api.cache import RECIPE_LIST_VERSION, bump
+from api.sync import lock_users
+from recipes.documents import schedule_rebuild
+from recipes.management.commands.export_recipes import (
+    IMAGES_DIR,
+    RECIPES_FILE,
+)
+from recipes.models import (
+    ArrayIngredient,
+    ChangeLog,
+    ImportProgress,
+    Ingredient,
+    Recipe,
+    Tag,
+)
+from recipes.reference import bump_version
+
+User = get_user_model()
+
+CHUNK_SIZE = 1000
+IMAGE_UPLOAD_TO = Recipe._meta.get_field('image').upload_to
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает рецепты, выгруженные export_recipes. Рецепты '
+        'сохраняются пачками, прерванная загрузка продолжается с '
+        'первой несохраненной пачки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Каталог с выгрузкой')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Начать загрузку заново, не учитывая сохраненный прогресс',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        source = os.path.join(path, RECIPES_FILE)
+        if not os.path.exists(source):
+            raise CommandError(f'Файл {source} не найден.')
+        self.images = os.path.join(path, IMAGES_DIR)
+        self.source = self.digest(source)
+        self.rejected_images = 0
+        progress, _ = ImportProgress.objects.get_or_create(
+            source=self.source
+        )
+        if options['restart'] and progress.lines:
+            progress.lines = 0
+            progress.save(update_fields=('lines',))
+        done = progress.lines
+        if done:
+            self.stdout.write(f'Продолжение со строки {done + 1}')
+        imported = skipped = 0
+        start = time.monotonic()
+        with open(source, encoding='utf-8') as file:
+            lines = itertools.islice(file, done, None)
+            while True:
+                raw = list(itertools.islice(lines, options['chunk_size']))
+                if not raw:
+                    break
+                chunk = [json.loads(line) for line in raw if line.strip()]
+                saved = self.import_chunk(chunk, done, done + len(raw))
+                imported += saved
+                skipped += len(chunk) - saved
+                done += len(raw)
+                elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f'Строк: {done}, загружено: {imported}, '
+                    f'{imported / max(elapsed, 1e-6):.0f} рецептов в секунду'
+                )
+        ImportProgress.objects.filter(source=self.source).delete()
+        if self.rejected_images:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущено изображений с недопустимым именем: '
+                f'{self.rejected_images}'
+            ))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущено рецептов с неизвестным автором: {skipped}'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {imported} '
+            f'за {time.monotonic() - start:.1f} с'
+        ))
+
+    @staticmethod
+    def digest(source):
+        """Хеш содержимого выгрузки, ключ сохраненного прогресса."""
+        digest = hashlib.sha256()
+        with open(source, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def resolve(self, model, keys, fields, defaults):
+        """id справочных записей по ключам, недостающие создаются."""
+        keys = set(keys)
+        lookup = {fields[0] + '__in': {key[0] for key in keys}}
+        found = {}
+        for values in model.objects.filter(**lookup).order_by(
+            '-id'
+        ).values_list('id', *fields):
+            found[values[1:]] = values[0]
+        missing = keys - set(found)
+        if missing:
+            model.objects.bulk_create(
+                model(**dict(zip(fields, key)), **defaults(key))
+                for key in missing
+            )
+            # Не все базы возвращают id из bulk_create.
+            for values in model.objects.filter(**lookup).order_by(
+                '-id'
+            ).values_list('id', *fields):
+                found[values[1:]] = values[0]
+            self.reference_changed = True
+        return found
+
+    def save_image(self, name):
+        if not name:
+            return None
+        # Имя приходит из архива: путь отбрасываем, чтобы файл не попал
+        # за пределы каталога изображений.
+        name = os.path.basename(name)
+        extension = os.path.splitext(name)[1][1:].lower()
+        path = os.path.join(self.images, name)
+        if (
+            name.startswith('.')
+            or extension not in get_available_image_extensions()
+            or os.path.islink(path)
+        ):
+            self.rejected_images += 1
+            return None
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as file:
+            return default_storage.save(IMAGE_UPLOAD_TO + name, File(file))
+
+    @transaction.atomic
+    def import_chunk(self, chunk, start, end):
+        """Сохраняет пачку строк start-end и возвращает число рецептов.
+
+        Прогресс сдвигается в той же транзакции: пачка либо сохранена
+        вместе с ним, либо не сохранена совсем.
+        """
+        if not ImportProgress.objects.filter(
+            source=self.source, lines=start
+        ).update(lines=end):
+            raise CommandError(
+                'Прогресс загрузки изменился: выгрузку загружает другой '
+                'процесс.'
+            )
+        self.reference_changed = False
+        authors = dict(User.objects.filter(
+            email__in={data['author'] for data in chunk}
+        ).values_list('email', 'id'))
+        chunk = [data for data in chunk if data['author'] in authors]
+        tags = self.resolve(
+            Tag,
+            (
+                (tag['slug'],) for data in chunk for tag in data['tags']
+            ),
+            ('slug',),
+            lambda key: {'name': next(
+                tag['name'] for data in chunk for tag in data['tags']
+                if tag['slug'] == key[0]
+            )},
+        )
+        ingredients = self.resolve(
+            Ingredient,
+            (
+                (item['name'], item['measurement_unit'])
+                for data in chunk for item in data['ingredients']
+            ),
+            ('name', 'measurement_unit'),
+            lambda key: {},
+        )
+        recipes = [
+            Recipe(
+                author_id=authors[data['author']],
+                name=data['name'],
+                text=data['text'],
+                cooking_time=data['cooking_time'],
+                image=self.save_image(data['image']),
+            )
+            for data in chunk
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+            lock_users(recipe.author_id for recipe in recipes)
+            ChangeLog.objects.bulk_create(
+                ChangeLog(
+                    user_id=recipe.author_id,
+                    kind=ChangeLog.RECIPE,
+                    object_id=recipe.id,
+                )
+                for recipe in recipes
+            )
+        else:
+            for recipe in recipes:
+                recipe.save()
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+            for recipe, data in zip(recipes, chunk)
+            for tag_id in {tags[(tag['slug'],)] for tag in data['tags']}
+        )
+        array_ingredients = []
+        for recipe, data in zip(recipes, chunk):
+            amounts = {}
+            for item in data['ingredients']:
+                amounts.setdefault(
+                    ingredients[(item['name'], item['measurement_unit'])],
+                    item['amount'],
+                )
+            array_ingredients.extend(
+                ArrayIngredient(
+                    recipes_id=recipe.id,
+                    ingredients_id=ingredient_id,
+                    amount=amount,
+                )
+                for ingredient_id, amount in amounts.items()
+            )
+        ArrayIngredient.objects.bulk_create(array_ingredients)
+        # bulk_create не отправляет сигналы.
+        schedule_rebuild(recipe.id for recipe in recipes)
+        transaction.on_commit(lambda: bump(RECIPE_LIST_VERSION))
+        if self.reference_changed:
+            transaction.on_commit(bump_version)
+        return len(recipes)
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+
+from recipes.documents import build_document, rebuild, source_queryset
+from recipes.models import Recipe, RecipeDocument
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает недостающие документы рецептов. С --verify сравнивает '
+        'сохраненные документы с данными рецептов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересобрать документы всех рецептов',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Найти устаревшие документы',
+        )
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Вместе с --verify пересобрать устаревшие документы',
+        )
+
+    def chunks(self, queryset):
+        ids = list(queryset.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), CHUNK_SIZE):
+            yield ids[start:start + CHUNK_SIZE]
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify(fix=options['fix'])
+        recipes = Recipe.objects.all()
+        if not options['all']:
+            recipes = recipes.filter(document__isnull=True)
+        count = 0
+        for chunk in self.chunks(recipes):
+            count += len(rebuild(chunk))
+        self.stdout.write(self.style.SUCCESS(
+            f'Собрано документов: {count}'
+        ))
+
+    def verify(self, fix=False):
+        stale = []
+        for chunk in self.chunks(Recipe.objects.all()):
+            stored = RecipeDocument.objects.in_bulk(chunk)
+            for recipe in source_queryset().filter(id__in=chunk):
+                document = stored.get(recipe.id)
+                if document is None or document.data != build_document(
+                    recipe
+                ):
+                    stale.append(recipe.id)
+        for start in range(0, len(stale), CHUNK_SIZE):
+            if fix:
+                rebuild(stale[start:start + CHUNK_SIZE])
+        message = f'Устаревших или отсутствующих документов: {len(stale)}'
+        if stale and not fix:
+            self.stdout.write(self.style.WARNING(message))
+            self.stdout.write(', '.join(map(str, stale[:100])))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
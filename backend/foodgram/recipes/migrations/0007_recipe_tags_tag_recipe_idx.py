@@ -0,0 +1,38 @@
+from django.db import migrations
+
+INDEX = 'recipes_recipe_tags_tag_recipe_idx'
+
+
+def create_index(apps, schema_editor):
+    through = apps.get_model('recipes', 'Recipe').tags.through
+    quote = schema_editor.quote_name
+    columns = ', '.join(
+        quote(through._meta.get_field(name).column)
+        for name in ('tag', 'recipe')
+    )
+    schema_editor.execute(
+        f'CREATE INDEX {quote(INDEX)} '
+        f'ON {quote(through._meta.db_table)} ({columns})'
+    )
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX {schema_editor.quote_name(INDEX)}')
+
+
+class Migration(migrations.Migration):
+    """Индекс (tag, recipe) для EXISTS-фильтра по тегам.
+
+    Промежуточная таблица тегов создается Django автоматически, у нее
+    нет Meta для AddIndex, поэтому индекс создается SQL-запросом по имени
+    таблицы и столбцов из модели. Уникальный индекс (user, recipes)
+    у избранного и корзины уже есть.
+    """
+
+    dependencies = [
+        ('recipes', '0006_recipedocument'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
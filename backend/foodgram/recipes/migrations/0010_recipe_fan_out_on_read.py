@@ -0,0 +1,39 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:32
+
+from django.db import migrations, models
+from django.db.models import Count
+
+from api.const import FEED_FANOUT_MAX_FOLLOWERS
+
+
+def mark_crowded_authors(apps, schema_editor):
+    """Рецепты авторов, которые раньше подмешивались при чтении."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Subscription = apps.get_model('users', 'Subscription')
+    crowded = Subscription.objects.values('following_id').annotate(
+        followers=Count('id')
+    ).filter(
+        followers__gt=FEED_FANOUT_MAX_FOLLOWERS
+    ).values('following_id')
+    Recipe.objects.filter(author_id__in=crowded).update(fan_out_on_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('recipes', '0009_changelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='fan_out_on_read',
+            field=models.BooleanField(default=False, verbose_name='Подмешивается в ленту при чтении'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('fan_out_on_read', True)), fields=['author', '-id'], name='recipe_fan_out_on_read_idx'),
+        ),
+        migrations.RunPython(mark_crowded_authors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:34
+
+from django.db import migrations, models
+
+SIMILAR_RECIPES = 'similar_recipes'
+
+
+def move_runs(apps, schema_editor):
+    """Запуски раньше записывались в очередь задач выполненными Job."""
+    Job = apps.get_model('jobs', 'Job')
+    SimilarityRun = apps.get_model('recipes', 'SimilarityRun')
+    runs = Job.objects.filter(kind=SIMILAR_RECIPES, status='done')
+    SimilarityRun.objects.bulk_create(
+        SimilarityRun(
+            params=job.payload.get('params', {}),
+            recipes=job.payload.get('recipes', 0),
+            started_at=job.started_at,
+        )
+        for job in runs.exclude(started_at=None).order_by('started_at')
+    )
+    Job.objects.filter(kind=SIMILAR_RECIPES).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0002_private_results'),
+        ('recipes', '0010_recipe_fan_out_on_read'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('params', models.JSONField(verbose_name='Параметры')),
+                ('recipes', models.PositiveIntegerField(verbose_name='Пересчитано рецептов')),
+                ('started_at', models.DateTimeField(verbose_name='Запущен')),
+                ('finished_at', models.DateTimeField(auto_now_add=True, verbose_name='Завершен')),
+            ],
+            options={
+                'verbose_name': 'Пересчет похожих рецептов',
+                'verbose_name_plural': 'Пересчеты похожих рецептов',
+                'ordering': ('-started_at',),
+            },
+        ),
+        migrations.RunPython(move_runs, migrations.RunPython.noop),
+    ]
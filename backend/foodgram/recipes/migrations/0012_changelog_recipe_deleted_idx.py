@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_similarityrun'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(condition=models.Q(('deleted', True), ('kind', 'recipe')), fields=['created_at'], name='changelog_recipe_deleted_idx'),
+        ),
+    ]
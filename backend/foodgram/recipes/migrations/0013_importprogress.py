@@ -0,0 +1,25 @@
+# Generated by Django 3.2.3 on 2026-10-19 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_changelog_recipe_deleted_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=64, unique=True, verbose_name='Хеш выгрузки')),
+                ('lines', models.PositiveBigIntegerField(default=0, verbose_name='Загружено строк')),
+            ],
+            options={
+                'verbose_name': 'Загрузка рецептов',
+                'verbose_name_plural': 'Загрузки рецептов',
+            },
+        ),
+    ]
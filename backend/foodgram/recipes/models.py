@@ -56,6 +56,46 @@ class Ingredient(models.Model):
         return self.name
 
 
+class ReferenceDataVersion(models.Model):
+    """Версия справочников тегов и ингредиентов.
+
+    Увеличивается при любом изменении Tag и Ingredient, по ней воркеры
+    сбрасывают закешированные справочники.
+    """
+    version = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Версия',
+    )
+
+    class Meta:
+        verbose_name = 'Версия справочников'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return str(self.version)
+
+
+class CacheInvalidation(models.Model):
+    """Изменение ключа общего кеша.
+
+    Воркеры читают записи с id больше последнего прочитанного и удаляют
+    эти ключи из кеша в памяти процесса (api.cache).
+    """
+    key = models.CharField(max_length=250, verbose_name='Ключ')
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата изменения',
+    )
+
+    class Meta:
+        verbose_name = 'Изменение кеша'
+        verbose_name_plural = 'Изменения кеша'
+
+    def __str__(self):
+        return self.key
+
+
 class Recipe(models.Model):
     tags = models.ManyToManyField(
         Tag,
@@ -88,10 +128,28 @@ class Recipe(models.Model):
         verbose_name='Время приготовления',
         validators=(validation_cooking_time,)
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения',
+    )
+    # Решение принимается при публикации (api.feed.fan_out) и больше не
+    # меняется, даже если подписчиков у автора станет меньше.
+    fan_out_on_read = models.BooleanField(
+        default=False,
+        verbose_name='Подмешивается в ленту при чтении',
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_fan_out_on_read_idx',
+                condition=models.Q(fan_out_on_read=True),
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -212,3 +270,195 @@ class ShortLinkRecipe(models.Model):
 
     def __str__(self) -> str:
         return f'{self.shortlink}'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='Unique recipes in timeline'
+            ),
+        )
+
+    def __str__(self):
+        return f'Рецепт {self.recipe} в ленте {self.user}'
+
+
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(verbose_name='Схожесть')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        ordering = ('recipe', '-score')
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='Unique similar recipes'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('recipe', '-score'),
+                name='similar_recipe_score_idx',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} похож на {self.similar} ({self.score:.2f})'
+
+
+class SimilarityRun(models.Model):
+    """Запуск пересчета похожих рецептов (build_similar_recipes).
+
+    По последнему запуску с теми же параметрами пересчитываются только
+    рецепты, измененные после его начала.
+    """
+    params = models.JSONField(verbose_name='Параметры')
+    recipes = models.PositiveIntegerField(verbose_name='Пересчитано рецептов')
+    started_at = models.DateTimeField(verbose_name='Запущен')
+    finished_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Завершен',
+    )
+
+    class Meta:
+        verbose_name = 'Пересчет похожих рецептов'
+        verbose_name_plural = 'Пересчеты похожих рецептов'
+        ordering = ('-started_at',)
+
+    def __str__(self):
+        return f'Пересчет {self.started_at:%Y-%m-%d %H:%M}: {self.recipes}'
+
+
+class ImportProgress(models.Model):
+    """Прогресс загрузки выгрузки рецептов (import_recipes).
+
+    Число загруженных строк обновляется в транзакции пачки, поэтому после
+    сбоя загрузка продолжается с первой несохраненной строки.
+    """
+    source = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='Хеш выгрузки',
+    )
+    lines = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Загружено строк',
+    )
+
+    class Meta:
+        verbose_name = 'Загрузка рецептов'
+        verbose_name_plural = 'Загрузки рецептов'
+
+    def __str__(self):
+        return f'{self.source[:12]}: {self.lines}'
+
+
+class RecipeDocument(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='document',
+        verbose_name='Рецепт',
+    )
+    data = models.JSONField(verbose_name='Документ')
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата сборки',
+    )
+
+    class Meta:
+        verbose_name = 'Документ рецепта'
+        verbose_name_plural = 'Документы рецептов'
+
+    def __str__(self):
+        return f'Документ рецепта {self.recipe_id}'
+
+
+class ChangeLog(models.Model):
+    """Изменение данных пользователя для синхронизации клиентов.
+
+    Пишется в одной транзакции с изменением, id служит токеном
+    синхронизации (/api/sync/?since=).
+    """
+    RECIPE = 'recipe'
+    FAVORITE = 'favorite'
+    SHOPPING_CART = 'shopping_cart'
+    SUBSCRIPTION = 'subscription'
+    KINDS = (
+        (RECIPE, 'Рецепт'),
+        (FAVORITE, 'Избранное'),
+        (SHOPPING_CART, 'Корзина'),
+        (SUBSCRIPTION, 'Подписка'),
+    )
+
+    # Без ограничения в базе: при удалении пользователя удаляются его
+    # рецепты, и сигналы пишут изменения уже удаляемого пользователя.
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='changes',
+        verbose_name='Пользователь',
+    )
+    kind = models.CharField(
+        max_length=max(len(kind) for kind, _ in KINDS),
+        choices=KINDS,
+        verbose_name='Тип объекта',
+    )
+    object_id = models.PositiveBigIntegerField(verbose_name='Объект')
+    deleted = models.BooleanField(default=False, verbose_name='Удален')
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата изменения',
+    )
+
+    class Meta:
+        verbose_name = 'Изменение'
+        verbose_name_plural = 'Изменения'
+        indexes = (
+            models.Index(
+                fields=('user', 'id'),
+                name='changelog_user_id_idx',
+            ),
+            # Удаленные рецепты убираются из индекса api.pantry.
+            models.Index(
+                fields=('created_at',),
+                name='changelog_recipe_deleted_idx',
+                condition=models.Q(kind='recipe', deleted=True),
+            ),
+        )
+
+    def __str__(self):
+        action = 'удален' if self.deleted else 'изменен'
+        return f'{self.get_kind_display()} {self.object_id} {action}'
@@ -0,0 +1,120 @@
+"""Кеш справочников тегов и ингредиентов в памяти процесса.
+
+Перед первым обращением в каждом запросе кеш сверяет свою версию с
+ReferenceDataVersion одним запросом по первичному ключу и при
+расхождении перечитывает справочники целиком. Справочники новой версии
+читает из базы один воркер, остальные берут их из общего кеша.
+"""
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+
+from api.const import REFERENCE_CACHE_TTL
+from api.metrics import CACHE_REQUESTS
+from recipes.models import Ingredient, ReferenceDataVersion, Tag
+
+VERSION_ID = 1
+
+
+def bump_version(**kwargs):
+    """Отмечает изменение справочников для всех воркеров."""
+    updated = ReferenceDataVersion.objects.filter(pk=VERSION_ID).update(
+        version=F('version') + 1
+    )
+    if not updated:
+        ReferenceDataVersion.objects.get_or_create(
+            pk=VERSION_ID, defaults={'version': 1}
+        )
+    reference.version = None
+
+
+class ReferenceCache:
+
+    def __init__(self):
+        self.version = None
+        self.checked = False
+        self.tags = {}
+        self.tag_slugs = {}
+        self.ingredients = {}
+        self.ingredient_names = []
+
+    def __deepcopy__(self, memo):
+        # Поля DRF и фильтры django-filter копируются глубоко вместе со
+        # связанными методами кеша; копия кеша была бы пустой и
+        # перечитывала бы справочники.
+        return self
+
+    def mark_unchecked(self, **kwargs):
+        """Вызывается в начале каждого запроса."""
+        self.checked = False
+
+    def ensure_fresh(self):
+        if self.checked and self.version is not None:
+            return
+        version = ReferenceDataVersion.objects.filter(
+            pk=VERSION_ID
+        ).values_list('version', flat=True).first() or 0
+        if version != self.version:
+            self.load(version)
+            CACHE_REQUESTS.labels('reference', 'miss').inc()
+        else:
+            CACHE_REQUESTS.labels('reference', 'hit').inc()
+        self.checked = True
+
+    def fetch(self):
+        return (
+            list(Tag.objects.order_by('id')),
+            list(Ingredient.objects.order_by('name', 'id')),
+        )
+
+    def load(self, version):
+        if connection.in_atomic_block:
+            # Версия может быть еще не зафиксирована.
+            tags, ingredients = self.fetch()
+        else:
+            tags, ingredients = cache.get_or_compute(
+                f'reference:{version}', self.fetch, REFERENCE_CACHE_TTL
+            )
+        self.tags = {tag.id: tag for tag in tags}
+        self.tag_slugs = {tag.slug: tag.id for tag in tags}
+        self.ingredients = {
+            ingredient.id: ingredient for ingredient in ingredients
+        }
+        self.ingredient_names = [
+            (ingredient.name.lower(), ingredient) for ingredient in ingredients
+        ]
+        self.version = version
+
+    def tag(self, pk):
+        self.ensure_fresh()
+        return self.tags.get(pk)
+
+    def all_tags(self):
+        self.ensure_fresh()
+        return list(self.tags.values())
+
+    def tag_ids(self, slugs):
+        self.ensure_fresh()
+        return [
+            self.tag_slugs[slug] for slug in slugs if slug in self.tag_slugs
+        ]
+
+    def tag_choices(self):
+        self.ensure_fresh()
+        return [(slug, slug) for slug in self.tag_slugs]
+
+    def ingredient(self, pk):
+        self.ensure_fresh()
+        return self.ingredients.get(pk)
+
+    def search_ingredients(self, prefix=''):
+        """Ингредиенты, название которых начинается с prefix."""
+        self.ensure_fresh()
+        prefix = prefix.lower()
+        return [
+            ingredient for name, ingredient in self.ingredient_names
+            if name.startswith(prefix)
+        ]
+
+
+reference = ReferenceCache()
@@ -0,0 +1,171 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    post_init,
+    pre_delete,
+)
+
+from api import membership
+from api.cache import RECIPE_LIST_VERSION, SHORT_LINK_KEY, bump
+from api.storage import release
+from api.sync import record_change
+
+from recipes.documents import AUTHOR_FIELDS, schedule_rebuild
+from recipes.models import (
+    ArrayIngredient,
+    ChangeLog,
+    Favorite,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+    ShortLinkRecipe,
+    Tag,
+)
+from recipes.reference import bump_version, reference
+from users.models import Subscription
+
+User = get_user_model()
+
+PROFILE_FIELDS = frozenset(AUTHOR_FIELDS) | {'avatar'}
+MEDIA_FIELDS = {Recipe: 'image', User: 'avatar'}
+# Модель: (тип изменения, владелец, объект для клиента).
+CHANGE_KINDS = {
+    Recipe: (ChangeLog.RECIPE, 'author_id', 'id'),
+    Favorite: (ChangeLog.FAVORITE, 'user_id', 'recipes_id'),
+    ShoppingCart: (ChangeLog.SHOPPING_CART, 'user_id', 'recipes_id'),
+    Subscription: (ChangeLog.SUBSCRIPTION, 'user_id', 'following_id'),
+}
+
+
+def recipe_saved(sender, instance, **kwargs):
+    schedule_rebuild([instance.id])
+
+
+def recipe_list_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump(RECIPE_LIST_VERSION))
+
+
+def membership_changed(sender, instance, **kwargs):
+    membership.forget(instance.user_id)
+
+
+def short_link_changed(sender, instance, **kwargs):
+    key = SHORT_LINK_KEY.format(instance.shortlink)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def array_ingredient_changed(sender, instance, **kwargs):
+    schedule_rebuild([instance.recipes_id])
+
+
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        schedule_rebuild([instance.pk])
+    elif pk_set:
+        schedule_rebuild(pk_set)
+    else:
+        schedule_rebuild(instance.recipes.values_list('id', flat=True))
+
+
+def tag_changed(sender, instance, **kwargs):
+    schedule_rebuild(instance.recipes.values_list('id', flat=True))
+
+
+def ingredient_changed(sender, instance, **kwargs):
+    schedule_rebuild(
+        instance.array_ingredients.values_list('recipes_id', flat=True)
+    )
+
+
+def profile_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not PROFILE_FIELDS & set(update_fields):
+        return
+    schedule_rebuild(
+        Recipe.objects.filter(author=instance).values_list('id', flat=True)
+    )
+
+
+def media_loaded(sender, instance, **kwargs):
+    """Запоминает имя файла, с которым запись загружена из базы."""
+    value = instance.__dict__.get(MEDIA_FIELDS[sender])
+    instance._loaded_media = getattr(value, 'name', value)
+
+
+def media_post_save(sender, instance, created, update_fields=None, **kwargs):
+    field = MEDIA_FIELDS[sender]
+    if not created and update_fields is not None and (
+        field not in update_fields
+    ):
+        return
+    old = getattr(instance, '_loaded_media', None)
+    new = getattr(instance, field).name
+    instance._loaded_media = new
+    if not created and old and old != new:
+        transaction.on_commit(lambda: release(old))
+
+
+def media_post_delete(sender, instance, **kwargs):
+    name = getattr(instance, MEDIA_FIELDS[sender]).name
+    if name:
+        transaction.on_commit(lambda: release(name))
+
+
+def log_change(sender, instance, signal, **kwargs):
+    kind, owner, target = CHANGE_KINDS[sender]
+    record_change(ChangeLog(
+        user_id=getattr(instance, owner),
+        kind=kind,
+        object_id=getattr(instance, target),
+        deleted=signal is post_delete,
+    ))
+
+
+def connect():
+    request_started.connect(
+        reference.mark_unchecked,
+        dispatch_uid='reference_mark_unchecked'
+    )
+    for model in (Tag, Ingredient):
+        post_save.connect(
+            bump_version,
+            sender=model,
+            dispatch_uid=f'reference_save_{model.__name__}'
+        )
+        post_delete.connect(
+            bump_version,
+            sender=model,
+            dispatch_uid=f'reference_delete_{model.__name__}'
+        )
+    post_save.connect(recipe_saved, sender=Recipe)
+    post_save.connect(recipe_list_changed, sender=Recipe)
+    post_delete.connect(recipe_list_changed, sender=Recipe)
+    for model in membership.LISTS:
+        post_save.connect(membership_changed, sender=model)
+        post_delete.connect(membership_changed, sender=model)
+    post_save.connect(short_link_changed, sender=ShortLinkRecipe)
+    post_delete.connect(short_link_changed, sender=ShortLinkRecipe)
+    post_save.connect(array_ingredient_changed, sender=ArrayIngredient)
+    post_delete.connect(array_ingredient_changed, sender=ArrayIngredient)
+    m2m_changed.connect(recipe_tags_changed, sender=Recipe.tags.through)
+    post_save.connect(tag_changed, sender=Tag)
+    # Связи с тегом удаляются без сигналов, поэтому рецепты собираются
+    # до удаления.
+    pre_delete.connect(tag_changed, sender=Tag)
+    post_save.connect(ingredient_changed, sender=Ingredient)
+    post_save.connect(profile_changed, sender=User)
+    # Файл без других ссылок удаляется, когда его заменили или удалили
+    # запись.
+    for model in MEDIA_FIELDS:
+        post_init.connect(media_loaded, sender=model)
+        post_save.connect(media_post_save, sender=model)
+        post_delete.connect(media_post_delete, sender=model)
+    for model in CHANGE_KINDS:
+        post_save.connect(log_change, sender=model)
+        post_delete.connect(log_change, sender=model)
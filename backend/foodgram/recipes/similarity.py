@@ -0,0 +1,156 @@
+"""Расчет похожих рецептов по общим ингредиентам и тегам.
+
+Матрица рецепт x признак строится из ArrayIngredient и связей с тегами.
+Ингредиент дает признаку вес 1, тег - tag_weight, поэтому скалярное
+произведение строк равно взвешенному числу общих признаков. Схожесть
+считается блоками строк, онлайн-запросы читают готовую таблицу
+SimilarRecipe.
+"""
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+from api.const import (
+    SIMILAR_RECIPES_BLOCK_SIZE,
+    SIMILAR_RECIPES_TAG_WEIGHT,
+    SIMILAR_RECIPES_TOP_K,
+)
+from recipes.models import ArrayIngredient, Recipe, SimilarRecipe
+
+JACCARD = 'jaccard'
+COSINE = 'cosine'
+METRICS = (JACCARD, COSINE)
+
+
+class RecipeMatrix:
+    """Разреженная матрица признаков всех рецептов."""
+
+    def __init__(self, tag_weight=SIMILAR_RECIPES_TAG_WEIGHT):
+        self.ids = np.fromiter(
+            Recipe.objects.order_by('id').values_list('id', flat=True),
+            dtype=np.int64,
+        )
+        rows, cols, values = [], [], []
+        columns = {}
+        pairs = ArrayIngredient.objects.values_list(
+            'recipes_id', 'ingredients_id'
+        ).iterator()
+        for recipe_id, ingredient_id in pairs:
+            rows.append(recipe_id)
+            cols.append(columns.setdefault(('i', ingredient_id), len(columns)))
+            values.append(1.0)
+        if tag_weight:
+            pairs = Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag_id'
+            ).iterator()
+            for recipe_id, tag_id in pairs:
+                rows.append(recipe_id)
+                cols.append(columns.setdefault(('t', tag_id), len(columns)))
+                values.append(np.sqrt(tag_weight))
+        row_index = np.searchsorted(self.ids, np.asarray(rows, np.int64))
+        self.matrix = sparse.csr_matrix(
+            (np.asarray(values, np.float32), (row_index, cols)),
+            shape=(len(self.ids), max(len(columns), 1)),
+        )
+        self.sizes = np.asarray(
+            self.matrix.multiply(self.matrix).sum(axis=1)
+        ).ravel()
+
+    def rows(self, recipe_ids):
+        """Номера строк матрицы для существующих рецептов."""
+        return np.flatnonzero(
+            np.isin(self.ids, np.fromiter(recipe_ids, dtype=np.int64))
+        )
+
+    def scores(self, rows, metric=JACCARD):
+        """Схожесть строк rows со всеми рецептами в формате COO."""
+        block = (self.matrix[rows] @ self.matrix.T).tocoo()
+        shared = block.data
+        first = self.sizes[rows][block.row]
+        second = self.sizes[block.col]
+        if metric == COSINE:
+            score = shared / np.sqrt(first * second)
+        else:
+            score = shared / (first + second - shared)
+        own = rows[block.row] == block.col
+        return block.row[~own], block.col[~own], score[~own]
+
+
+def top_k(candidates, k=SIMILAR_RECIPES_TOP_K):
+    """Лучшие k пар (id, score) по убыванию схожести."""
+    return sorted(candidates, key=lambda item: (-item[1], item[0]))[:k]
+
+
+def save_neighbours(neighbours):
+    """Перезаписывает списки похожих рецептов для ключей neighbours."""
+    SimilarRecipe.objects.filter(recipe_id__in=list(neighbours)).delete()
+    SimilarRecipe.objects.bulk_create(
+        [
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar, score=score)
+            for recipe_id, items in neighbours.items()
+            for similar, score in items
+        ],
+        batch_size=SIMILAR_RECIPES_BLOCK_SIZE * SIMILAR_RECIPES_TOP_K,
+    )
+
+
+def build(changed=None, metric=JACCARD, tag_weight=SIMILAR_RECIPES_TAG_WEIGHT,
+          k=SIMILAR_RECIPES_TOP_K, block_size=SIMILAR_RECIPES_BLOCK_SIZE):
+    """Пересчитывает похожие рецепты.
+
+    Если changed передан, полностью пересчитываются только измененные
+    рецепты и те, в чьих списках они были. Остальным рецептам новые
+    оценки подмешиваются в уже сохраненные списки: схожесть симметрична
+    и уже посчитана для строк измененных рецептов.
+    Возвращает количество пересчитанных рецептов.
+    """
+    data = RecipeMatrix(tag_weight=tag_weight)
+    if changed is None:
+        targets = set(data.ids.tolist())
+    else:
+        changed = list(changed)
+        targets = set(changed)
+        for start in range(0, len(changed), block_size):
+            targets.update(
+                SimilarRecipe.objects.filter(
+                    similar_id__in=changed[start:start + block_size]
+                ).values_list('recipe_id', flat=True)
+            )
+    rows = data.rows(targets)
+    merged = defaultdict(list)
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        row, col, score = data.scores(block_rows, metric=metric)
+        neighbours = defaultdict(list)
+        for source, target, value in zip(
+            data.ids[block_rows[row]].tolist(),
+            data.ids[col].tolist(),
+            score.tolist(),
+        ):
+            neighbours[source].append((target, value))
+            if changed is not None and target not in targets:
+                merged[target].append((source, value))
+        save_neighbours(
+            {
+                recipe_id: top_k(neighbours.get(recipe_id, ()), k)
+                for recipe_id in data.ids[block_rows].tolist()
+            }
+        )
+    keys = list(merged)
+    for start in range(0, len(keys), block_size):
+        chunk = keys[start:start + block_size]
+        current = defaultdict(dict)
+        for recipe_id, similar, score in SimilarRecipe.objects.filter(
+            recipe_id__in=chunk
+        ).values_list('recipe_id', 'similar_id', 'score'):
+            current[recipe_id][similar] = score
+        updates = {}
+        for recipe_id in chunk:
+            existing = top_k(current[recipe_id].items(), k)
+            candidates = {**current[recipe_id], **dict(merged[recipe_id])}
+            best = top_k(candidates.items(), k)
+            if best != existing:
+                updates[recipe_id] = best
+        save_neighbours(updates)
+    return len(rows)
@@ -1,5 +1,26 @@
 from django.contrib import admin
 from users.models import Subscription, User
 
-admin.site.register(User)
-admin.site.register(Subscription)
+
+class UserAdmin(admin.ModelAdmin):
+    list_display = (
+        'username',
+        'email',
+        'first_name',
+        'last_name',
+    )
+    search_fields = ('username', 'email')
+
+
+class SubscriptionAdmin(admin.ModelAdmin):
+    list_display = (
+        'user',
+        'following',
+    )
+    list_select_related = ('user', 'following')
+    search_fields = ('user__username', 'following__username')
+    autocomplete_fields = ('user', 'following')
+
+
+admin.site.register(User, UserAdmin)
+admin.site.register(Subscription, SubscriptionAdmin)
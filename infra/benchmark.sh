@@ -0,0 +1,29 @@
+#!/bin/sh
+# Сравнение пропускной способности API с микрокешем nginx и без него.
+#
+# Запуск из каталога infra при поднятом docker compose up:
+#   TOKEN=<токен из /api/auth/token/login/> ./benchmark.sh
+# Запросы с заголовком Authorization идут мимо кеша до gunicorn,
+# анонимные отдаются из кеша nginx.
+set -e
+
+URL=${URL:-http://localhost/api/recipes/?limit=6}
+REQUESTS=${REQUESTS:-2000}
+CONCURRENCY=${CONCURRENCY:-50}
+
+if [ -z "$TOKEN" ]; then
+    echo 'Укажите TOKEN - токен любого пользователя.' >&2
+    exit 1
+fi
+
+ab() {
+    docker run --rm --network host httpd:2.4-alpine \
+        ab -q -k -n "$REQUESTS" -c "$CONCURRENCY" "$@" "$URL" \
+        | grep -E 'Requests per second|Time per request|Failed requests'
+}
+
+echo "Без кеша (Authorization: Token ...):"
+ab -H "Authorization: Token $TOKEN"
+echo
+echo 'Микрокеш nginx (анонимно, gzip):'
+ab -H 'Accept-Encoding: gzip'